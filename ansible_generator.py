@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
 import sys
 import logging
+import multiprocessing
+import multiprocessing.util
+import os
 import re
-from jinja2 import Environment, FileSystemLoader
-from object_model import MIM, ModuleGenerationException
+from collections.abc import Mapping
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from object_model import MIM, DOC_URL, DN_LIMIT
+from meta_store import MetaStore, open_store, indexed_copy
+from doc_cache import DocCache, DEFAULT_TTL, DEFAULT_MAX_BYTES
+from crawler import prefetch, DEFAULT_WORKERS
+from build_manifest import BuildManifest, input_hash, MANIFEST_NAME
+from output_sink import DirectorySink, is_archive, open_sink
+from containment_graph import ContainmentGraph
+from dn_policy import DNPolicy, prompt_dn, DEFAULT_STRATEGY, LOCK_NAME
+import instrumentation
 from keyword import iskeyword
 
 # ====================================================================================
@@ -40,13 +53,99 @@ class MyLogger(object):
 # sys.stderr = MyLogger(logger, logging.ERROR)
 # ------------------------------------------------------------------------------------
 
+# Bump when a generator change affects module output, so that incremental
+# runs rebuild every module
+GENERATOR_VERSION = 1
+
+# Templates are looked up next to this file; compiled templates are kept on
+# disk across runs and recompiled when the template source changes
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_CACHE_DIR = os.environ.get('AUTOGEN_TEMPLATE_CACHE',
+                                    os.path.join(os.path.expanduser('~'), '.cache', 'ansible-autogen', 'templates'))
+_env = None
+
+def template_env():
+    """returns the template environment of this process, created on first use"""
+    global _env
+    if _env is None:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        _env = Environment(loader=FileSystemLoader(TEMPLATE_DIR),
+                           bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+                           auto_reload=True)
+    return _env
+
+
 def render(template_name, context):
-    env = Environment(loader=FileSystemLoader('.'))
-    return env.get_template(template_name).render(context)
+    return template_env().get_template(template_name).render(context)
+
+
+def render_to(template_name, context, f):
+    """renders a template straight into the file object f"""
+    template_env().get_template(template_name).stream(context).dump(f)
+
+
+_DELIMITERS = re.compile(r"(\{\[|\{).*?(\]\}|\})") # pattern to remove parameter names
+_FLIP_BRACKETS = re.compile(r"(\{\[).*?(\]\})") # pattern to sub {[]} to [{}]
+
+# hierarchy entries and naming parameters of the ancestors seen by set_hierarchy,
+# by (class, rns of the unnamed containers above it), for the MIM they were built from
+_fragments = {}
+_fragments_mim = None
+
+
+def _hierarchy_entry(klass, klass_mo, props, prefix, args):
+    """returns the set_hierarchy entry of klass, named by args"""
+    rn_format = _DELIMITERS.sub(r"\g<1>\g<2>", prefix + klass_mo.rnFormat)
+    rn_format = _FLIP_BRACKETS.sub("[{}]", rn_format)
+
+    # contruct rn format string
+    arg_str = "({})".format(", ".join(args))
+    rn = "\'{0}\'.format{1}".format(rn_format, arg_str)
+
+    #contruct filter string
+    if len(args) == 0:
+        filter_str = "\'\'"
+    elif len(args) == 1:
+        filter_str = "\'eq({0}.{1}, \"{{}}\")\'.format({2})".format(klass, props[0], args[0])
+    else:
+        filter_str = "\'and({0})\'.format{1}".format(
+            ",".join("eq({0}.{1}, \"{{}}\")".format(klass, prop) for prop in props), arg_str)
+
+    return {'name': klass,
+            'args': args or [None],
+            'rn': rn,
+            'filter': filter_str,
+            'rn_format': rn_format, # with {} for each naming property
+            'prefix': prefix, # rns of unnamed containers included in rn_format
+            'props': props
+            }
+
+
+def _ancestor_fragment(klass, klass_mo, props, prefix):
+    """returns the hierarchy entry and the naming parameters of an ancestor class"""
+    label = klass_mo.label.lower().replace(" ", "_")
+    parameters = []
+    for prop in props:
+        prop_info = klass_mo.properties[prop]
+        var = label if prop == "name" else "{0}_{1}".format(label, prop)
+        parameters.append((var, {'label': prop_info['label'],
+                                 'naming': True,
+                                 'help': prop_info.help,
+                                 'var': var}))
+    entry = _hierarchy_entry(klass, klass_mo, props, prefix, [var for var, details in parameters])
+    return entry, parameters
 
 
 def set_hierarchy(all_parameters, classes, mim, target):
-    """add parent class naming to ansible parameters and return hierarchy dict"""
+    """
+    add parent class naming to ansible parameters and return hierarchy dict
+    the entries of ancestors are built once per class and rn prefix for a given mim
+    and shared by every module below them
+    """
+    global _fragments_mim
+    if _fragments_mim is not mim:
+        _fragments.clear()
+        _fragments_mim = mim
     hierarchy = []
     unnamed_rn = ""
 
@@ -57,79 +156,36 @@ def set_hierarchy(all_parameters, classes, mim, target):
             if klass != "polUni":
                 unnamed_rn += klass_mo.rnFormat + "/"
             continue
-        rn_format = unnamed_rn + klass_mo.rnFormat
+        prefix = unnamed_rn
         unnamed_rn = ""
 
-        delimiters = "(\{\[|\{).*?(\]\}|\})" #pattern to remove paramter names
-        replace = "\g<1>\g<2>"
-        flip_brackets = "(\{\[).*?(\]\})" #pattern to sub {[]} to [{}]
-
-        rn_format = re.sub(delimiters, replace, rn_format)
-        rn_format = re.sub(flip_brackets, "[{}]", rn_format)
-
-        # get variable names
-        label = klass_mo.label.lower().replace(" ", "_")
-        args = []
-        for prop in props:
-            if klass != target:
-                details = {'label': klass_mo.properties[prop]['label'],
-                            'naming': True,
-                            'help': klass_mo.properties[prop]['help']}
-                var = label if prop == "name" else "{0}_{1}".format(label, prop)
-                args.append(var)
-                details['var'] = var
-                all_parameters[var] = details
-            else:
+        if klass != target:
+            key = (klass, prefix)
+            fragment = _fragments.get(key)
+            if fragment is None:
+                fragment = _fragments[key] = _ancestor_fragment(klass, klass_mo, props, prefix)
+            entry, parameters = fragment
+            for var, details in parameters:
+                all_parameters[var] = dict(details) # the module may change its own copy
+        else:
+            args = []
+            for prop in props:
                 all_parameters[prop]['naming'] = True
                 args.append(all_parameters[prop]['var'])
-
-        # contruct rn format string
-        if len(args) != 0:
-            arg_str = "("
-            i = 0
-            while i < len(args) - 1:
-                arg_str += args[i] + ", "
-                i += 1
-            arg_str += args[-1] + ")"
-        else:
-            arg_str = "()"
-        rn =  "\'{0}\'.format{1}".format(rn_format, arg_str)
-
-        #contruct filter string
-        if len(args) == 0:
-            filter_str = ""
-        elif len(args) == 1:
-            filter_str = "\'eq({0}.{1}, \"{{}}\")\'.format({2})".format(klass, props[0], args[0])
-        else:
-            filter_str = "\'and("
-            i = 0
-            while i < len(args) - 1:
-                filter_str += "eq({0}.{1}, \"{{}}\"),".format(klass, props[i])
-                i += 1
-            filter_str += "eq({0}.{1}, \"{{}}\"))\'.format{2}".format(klass, props[i], arg_str)
-
-        if filter_str == "":
-            filter_str = "\'\'"
-        if len(args) == 0:
-            args = [None]
-
-        hierarchy.append({'name': klass,
-                        'args': args,
-                        'rn': rn,
-                        'filter': filter_str
-                        })
+            entry = _hierarchy_entry(klass, klass_mo, props, prefix, args)
+        hierarchy.append(entry)
     return hierarchy
 
 
-def get_ansible_context(mim, mo):
+def get_ansible_context(mim, mo, choice=None):
 
     all_parameters = {} # will add other class naming later
     for key, value in mo.properties.items():
-        if value['isConfigurable']:
-            details = {'options': value['options'], #TODO: make sure options for is a list, not dict
+        if value.isConfigurable:
+            details = {'options': list(value.options), # shared tuple in the MO
                         # 'options': list(value['options'].keys()),
                         # 'label': value['label'],
-                        'help': value['help'],
+                        'help': value.help,
                         'payload': key,
                         'var': '_' + key if iskeyword(key) else key}
             if key == 'name':
@@ -143,20 +199,12 @@ def get_ansible_context(mim, mo):
                     'abstract': mo.isAbstract,
                     'configurable': mo.isConfigurable}
 
-    # ask user to choose DN format
-    if len(mo.dnFormat) > 1:
-        i = 1
-        for format in mo.dnFormat:
-            print("{}: {}".format(i, format[0]))
-            i += 1
-        choice = int(input("Enter number corresponding to desired DN format for {}\n".format(mo.klass)))-1
-    elif len(mo.dnFormat) == 0:
-        raise ModuleGenerationException("no DNs")
-    else:
-        choice = 0
+    if choice is None:
+        choice = prompt_dn(mo)
 
     classes = mo.dnFormat[choice][1]
-    hierarchy = set_hierarchy(all_parameters, classes, mim, mo.klass)
+    with instrumentation.phase('hierarchy'):
+        hierarchy = set_hierarchy(all_parameters, classes, mim, mo.klass)
 
     payload_parameters = {} #target class properties only #TODO just copy all parameters first
     for key, value in all_parameters.items():
@@ -164,6 +212,7 @@ def get_ansible_context(mim, mo):
             payload_parameters[key] = value
 
     return {'class': mo.klass,
+            'parent': classes[-2] if len(classes) > 1 else None,
             'keys': all_parameters,
             'pkeys': payload_parameters,
             'hierarchy': hierarchy,
@@ -171,66 +220,507 @@ def get_ansible_context(mim, mo):
             'dn': mo.dnFormat[choice][0]}
 
 
-def ansible_model(classes, meta):
-    mim = MIM(meta)
-    model = {klass: mim.get_class(klass) for klass in classes}
-    lines  = [] # lines for class list text file
-
-    for klass, value in model.items():
-        logger.info("Creating module for {0}".format(klass))
-        # out = "generated_{0}_module.py".format(klass)
-        out = "auto_{}.py".format(klass)
-
-        if value.isAbstract: # use abstract template
-            context = {'klass': klass, 'name': value.name, 'label': value.label, 'description': value.help, 'filename': out}
-            mod = render('ansible_2.6_read_only.py.j2', context)
-            with open(out, 'w') as f:
-                f.write(mod)
+def module_table(context):
+    """
+    returns the table of a thin module (see ansible_2.6_module_utils.py.j2)
+    built from the context of the class
+    """
+    if 'keys' not in context:
+        return {'class': context['klass'], 'abstract': True}
+    target = context['class']
+    hierarchy = []
+    for entry in context['hierarchy']:
+        if entry['name'] == target:
+            keys = list(entry['props']) # the options of the class are named after its properties
+        else:
+            keys = [arg for arg in entry['args'] if arg is not None]
+        hierarchy.append((entry['name'], entry['rn_format'], keys, list(entry['props']), entry['prefix']))
+    return {'class': target,
+            'parent': context['parent'],
+            'deletable': context['doc']['deletable'],
+            'aggregate': bool(context.get('aggregate')),
+            'params': [(key, value.get('payload'), value.get('options', []), value.get('aliases', []))
+                       for key, value in context['keys'].items()],
+            'hierarchy': hierarchy}
+
+
+def format_table(table):
+    """returns the python literal of a module table, one option and one hierarchy level per line"""
+    lines = ['{']
+    for key, value in table.items():
+        if isinstance(value, list):
+            lines.append("    {!r}: [".format(key))
+            lines.extend("        {!r},".format(item) for item in value)
+            lines.append("    ],")
         else:
-            context = get_ansible_context(mim, value)
-            context['filename'] = out
-            lines.append("{} {}".format(klass, context['dn']))
-            try:
-                with open(out, 'w') as f:
-                    mod = render('ansible_2.6_read_write.py.j2', context)
-                    f.write(mod)
-            except ModuleGenerationException as e:
-                logger.error(e)
+            lines.append("    {!r}: {!r},".format(key, value))
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+RUNTIME_TEMPLATE = 'ansible_2.6_module_utils.py.j2'
+RUNTIME_PATH = os.path.join('module_utils', 'aci_autogen.py')
+
+def write_runtime(sink):
+    """writes the module_utils runtime imported by thin modules to sink (see output_sink.py)"""
+    with sink.open(RUNTIME_PATH) as f:
+        render_to(RUNTIME_TEMPLATE, {}, f)
+
+
+def template_hash(template_name):
+    """
+    returns the sha256 of a template source and of the templates it imports,
+    computed once per process
+    """
+    if template_name not in _template_hashes:
+        with open(os.path.join(TEMPLATE_DIR, template_name), 'rb') as f:
+            source = f.read()
+        digest = hashlib.sha256(source)
+        for imported in _TEMPLATE_IMPORTS.findall(source.decode('utf-8')):
+            digest.update(template_hash(imported).encode('ascii'))
+        _template_hashes[template_name] = digest.hexdigest()
+    return _template_hashes[template_name]
+
+_template_hashes = {}
+
+# templates used by another one, e.g. {% from 'ansible_2.6_module_utils.py.j2' import aci_request %}
+_TEMPLATE_IMPORTS = re.compile(r"""\{%-?\s*(?:from|import|include|extends)\s+['"]([^'"]+)['"]""")
+
+
+def generate_module(mim, klass, choice=None, manifest=None, force=False, policy=None, options=None, sink=None):
+    """
+    renders the module for klass, unless manifest shows its inputs are unchanged
+    and the module is already in sink (or next to the manifest if there is no sink)
+    the DN format is chosen by policy, or asked for if there is none
+    options, if given, are template options added to the context (e.g. {'aggregate': True});
+    with 'thin', the module is a class table run by the module_utils runtime
+    returns a dict with keys:
+        'line': line for the class list text file, None for abstract classes
+        'out': generated file name
+        'hash': input hash of the module
+        'classes': classes of the chosen DN
+        'built': False if rendering was skipped
+        'content': text of the module, if built and sink is not shared (see
+                   output_sink.py); the module is streamed into a shared sink
+    """
+    mo = mim.get_class(klass)
+    out = "auto_{}.py".format(klass)
+
+    thin = bool(options and options.get('thin'))
+    if mo.isAbstract: # use abstract template
+        template = 'ansible_2.6_read_only.py.j2'
+        classes = []
+        dn = None
+    else:
+        template = 'ansible_2.6_read_write.py.j2'
+        if choice is None:
+            choice = policy.choose(mo) if policy is not None else prompt_dn(mo)
+        dn, classes = mo.dnFormat[choice]
+    if thin:
+        template = 'ansible_2.6_thin.py.j2'
+    records = [mim.meta[klass]]
+    for c in classes:
+        if c != klass:
+            mim.get_class(c) # loads the class when initialized without meta
+            records.append(mim.meta[c])
+    digest = input_hash(records, dn, template_hash(template), GENERATOR_VERSION, options)
+    result = {'line': None if mo.isAbstract else "{} {}".format(klass, dn),
+              'out': out,
+              'hash': digest,
+              'classes': list(classes),
+              'built': False}
+    if not force and manifest is not None and manifest.is_current(out, digest, sink):
+        return result
+
+    if mo.isAbstract:
+        context = {'klass': klass, 'name': mo.name, 'label': mo.label, 'description': mo.help, 'filename': out}
+    else:
+        context = get_ansible_context(mim, mo, choice)
+        context['filename'] = out
+    context.update(options or {})
+    if context.get('aggregate'):
+        # bulk configuration needs a parent and objects named by properties
+        context['aggregate'] = not mo.isAbstract and context['parent'] is not None and \
+            len(context['hierarchy'][-1]['props']) > 0
+    if not mo.isAbstract:
+        # naming options required by state absent and present; with aggregate, those of
+        # the class itself may come from the aggregate entries instead
+        context['required'] = [key for key, value in context['keys'].items()
+                               if value.get('naming') and not (context.get('aggregate') and value.get('payload'))]
+    if thin:
+        context['abstract'] = mo.isAbstract
+        context['table'] = format_table(module_table(context))
+
+    with instrumentation.phase('render'):
+        if sink is not None and sink.shared:
+            with sink.open(out) as f: # charged to render, as both happen at once
+                render_to(template, context, f)
+        else:
+            result['content'] = render(template, context)
+    result['built'] = True
+    return result
+
+
+# MIM, build manifest, template options and output sink of a worker process, loaded once by _init_worker
+# workers stream modules into a shared sink, and return them to the parent process for the others
+_worker_mim = None
+_worker_manifest = None
+_worker_options = None
+_worker_sink = None
+
+def _init_worker(meta, manifest, profiler, options=None, sink=None, cache=None, doc_url=DOC_URL, dn_limit=DN_LIMIT):
+    global _worker_mim, _worker_manifest, _worker_options, _worker_sink
+    if profiler.enabled:
+        instrumentation.enable(profiler.profile_dir)
+    # built like the MIM of the parent, so that classes missing from meta are
+    # fetched the same way and DNs are enumerated with the same limit
+    _worker_mim = MIM(meta, dn_limit=dn_limit, cache=cache, doc_url=doc_url)
+    if cache is not None:
+        # pages fetched by the worker are indexed when it exits
+        multiprocessing.util.Finalize(None, cache.flush, exitpriority=10)
+    _worker_manifest = manifest
+    _worker_options = options
+    _worker_sink = sink
+
+
+def _generate_task(task):
+    """runs generate_module in a worker; returns (class, result, error)"""
+    klass, choice, force = task
+    klass, result, error = _generate_logged(_worker_mim, klass, choice, _worker_manifest, force,
+                                            options=_worker_options, sink=_worker_sink)
+    if result is not None:
+        result['timings'] = instrumentation.profiler.take(klass) # reported by the parent process
+    return klass, result, error
+
+
+def _generate_logged(mim, klass, choice=None, manifest=None, force=False, policy=None, options=None, sink=None):
+    logger.info("Creating module for {0}".format(klass))
+    try:
+        with instrumentation.klass(klass):
+            result = generate_module(mim, klass, choice, manifest, force, policy, options, sink)
+    except Exception as e:
+        logger.exception("Failed to create module for {0}".format(klass))
+        return klass, None, "{}: {}".format(type(e).__name__, e)
+    if result['built']:
         logger.info("Successfully created module for {0}".format(klass))
+    else:
+        logger.info("Module for {0} is up to date".format(klass))
+    return klass, result, None
+
+
+def ansible_model(classes, meta, cache=None, doc_url=DOC_URL, fetch_workers=DEFAULT_WORKERS, fetch_rate=None,
+                  jobs=1, errors=None, manifest=None, force=False, policy=None, class_filter=None, index=None,
+                  graph=None, options=None, sink=None, dn_limit=DN_LIMIT, skipped=None):
+    """
+    generates the modules of classes, in order
+    classes is any iterable of class names, consumed as a stream; if None, every
+    class of the meta matching class_filter (keyword arguments of MIM.iter_classes)
+    is generated, except the concrete classes without a DN (such as topRoot),
+    which are added to skipped if given; abstract classes need no DN
+    DN formats are chosen by policy (a DNPolicy), or asked for if there is none
+    with jobs > 1 modules are rendered by a pool of worker processes, a batch of
+    classes at a time; DN formats are chosen up front in this process
+    errors, if given, is filled with the classes that failed and their error
+    manifest, if given, is used to skip modules whose inputs did not change
+    (unless force) and is updated with every generated module
+    index, if given, is a file the lines for the class list text file are
+    written to as modules are generated, instead of being returned
+    graph, if given, is the ContainmentGraph of meta used by class_filter
+    options, if given, are template options passed to generate_module
+    sink (see output_sink.py) receives the modules; without one, they are staged
+    and moved into the working directory once the run succeeds, none of them if
+    it fails (each module is replaced atomically, not the set of them)
+    dn_limit is the maximum number of DN formats listed for a class (None for all)
+    returns the lines for the class list text file
+    """
+    with instrumentation.phase('meta_load'):
+        mim = MIM(meta, dn_limit=dn_limit, cache=cache, doc_url=doc_url, graph=graph)
+    if classes is None:
+        classes = _with_dn(mim, mim.iter_classes(**(class_filter or {})), skipped)
+    elif not meta and fetch_workers:
+        classes = list(classes)
+        prefetch(mim, classes, fetch_workers, fetch_rate)
+    classes = _unique(classes)
+    lines  = [] # lines for class list text file
+    own_sink = sink is None
+    if own_sink:
+        sink = DirectorySink(os.curdir)
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_worker,
+                                    (meta if meta else mim.meta, manifest, instrumentation.profiler, options, sink,
+                                     cache, doc_url, mim.dn_limit))
+        results = _generate_parallel(pool, jobs, mim, classes, errors, force, policy)
+    else:
+        pool = None
+        results = (_generate_logged(mim, klass, None, manifest, force, policy, options, sink) for klass in classes)
+
+    try:
+        for klass, result, error in results:
+            if error is not None:
+                instrumentation.count('failed')
+                if errors is not None:
+                    errors[klass] = error
+                continue
+            instrumentation.count('built' if result['built'] else 'unchanged')
+            if 'timings' in result:
+                instrumentation.profiler.merge(klass, result['timings'])
+            if 'content' in result:
+                with instrumentation.klass(klass, profile=False), instrumentation.phase('file_write'):
+                    sink.write(result['out'], result.pop('content'))
+            if manifest is not None:
+                manifest.record(result['out'], result['hash'], klass, result['classes'], result['built'])
+            if result['line'] is None:
+                continue
+            if index is not None:
+                index.write(result['line'] + '\n')
+            else:
+                lines.append(result['line'])
+        if own_sink:
+            with instrumentation.phase('file_write'):
+                sink.commit()
+    finally:
+        if own_sink:
+            sink.abort() # nothing left to discard after a commit
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     return lines
 
 
+# decoded classes kept by an indexed meta store with --all
+ALL_CACHE_SIZE = 4096
+
+# classes handed to the worker pool at a time, per process
+BATCH_SIZE = 64
+
+def _generate_parallel(pool, jobs, mim, classes, errors, force, policy):
+    """yields the results of generating classes in pool, in order, one batch at a time"""
+    batch = []
+    for klass in classes:
+        try:
+            with instrumentation.klass(klass, profile=False):
+                mo = mim.get_class(klass)
+                if mo.isAbstract:
+                    choice = None
+                else:
+                    choice = policy.choose(mo) if policy is not None else prompt_dn(mo)
+            batch.append((klass, choice, force))
+        except Exception as e:
+            logger.exception("Failed to create module for {0}".format(klass))
+            instrumentation.count('failed')
+            if errors is not None:
+                errors[klass] = "{}: {}".format(type(e).__name__, e)
+        if len(batch) == jobs * BATCH_SIZE:
+            yield from pool.imap(_generate_task, batch, chunksize=BATCH_SIZE // 4)
+            batch = []
+    if batch:
+        yield from pool.imap(_generate_task, batch, chunksize=max(1, len(batch) // (jobs * 4)))
+
+
+def _with_dn(mim, classes, skipped):
+    """yields the abstract classes and those having a DN, adding the others to skipped if given"""
+    for klass in classes:
+        if mim.meta[klass]['isAbstract'] or mim.has_dn(klass):
+            yield klass
+            continue
+        logger.info("Skipping {0}, it has no DN".format(klass))
+        instrumentation.count('skipped')
+        if skipped is not None:
+            skipped.append(klass)
+
+
+def _unique(classes):
+    """yields each class name once, in order"""
+    seen = set()
+    for klass in classes:
+        if klass not in seen:
+            seen.add(klass)
+            yield klass
+
+
 def main():
     #TODO: add arguments for other documentation sources
     parser = argparse.ArgumentParser(description='Create an Ansible Module for a specified ACI class')
     parser.add_argument('-c', '--class', help='name of the class that the output module will manipulate', dest='klass')
     parser.add_argument('-l', '--list', help='path of text file containing class names')
-    parser.add_argument('-m', '--meta', help='path to aci meta json file')
+    parser.add_argument('-a', '--all', action='store_true', help='generate modules for every class of the meta; a json '
+                        'meta is first converted into an indexed meta file, cached in $AUTOGEN_META_CACHE, so that only '
+                        'a bounded number of classes is kept in memory')
+    parser.add_argument('--include-package', action='append', help='with --all, only classes of this package (repeatable)')
+    parser.add_argument('--exclude-package', action='append', help='with --all, skip classes of this package (repeatable)')
+    parser.add_argument('--configurable', choices=['true', 'false'], help='with --all, only classes with this isConfigurable')
+    parser.add_argument('--abstract', choices=['true', 'false'], help='with --all, only classes with this isAbstract')
+    parser.add_argument('--under', metavar='CLASS', help='with --all, only classes contained (directly or not) by CLASS')
+    parser.add_argument('-i', '--index', help='path of the class list text file to write (class and DN per line)')
+    parser.add_argument('-m', '--meta', help='path to aci meta json file, indexed meta file or metagen --shard directory (see meta_store.py)')
+    parser.add_argument('--cache-dir', help='directory caching documentation pages when no meta file is given')
+    parser.add_argument('--cache-ttl', type=int, default=DEFAULT_TTL, help='seconds before a cached page is revalidated')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='size limit of the cache in MB')
+    parser.add_argument('--offline', action='store_true', help='only use cached documentation pages')
+    parser.add_argument('--seed-pages', help='directory of saved MO-<class>.html pages to add to the cache')
+    parser.add_argument('--doc-url', default=DOC_URL, help='URL of class documentation pages, formatted with the class name')
+    parser.add_argument('--fetch-workers', type=int, default=DEFAULT_WORKERS,
+                        help='concurrent documentation requests when no meta file is given (0 to fetch on demand)')
+    parser.add_argument('--fetch-rate', type=float, help='maximum documentation requests per second')
+    parser.add_argument('--aggregate', action='store_true', help='add an aggregate option to read/write modules, '
+                        'configuring a list of objects under one parent in bulk requests')
+    parser.add_argument('--thin', action='store_true', help='generate thin modules, each a table of its class run by '
+                        'a shared runtime written to {}'.format(RUNTIME_PATH))
+    parser.add_argument('-o', '--output', default=os.curdir, help='directory the modules are written to, or a '
+                        '.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz or .zip archive to write them into')
+    parser.add_argument('--no-fsync', action='store_true', help='do not flush the modules to disk before '
+                        'moving them into the output directory')
+    parser.add_argument('--validate', action='store_true', help='check the generated modules (see validate.py), '
+                        'failing if any is invalid')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes rendering modules')
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild modules whose inputs did not change')
+    parser.add_argument('--dn-policy', help='json rules file choosing DN formats without prompting (see dn_policy.py)')
+    parser.add_argument('--dn-strategy', help='choose DN formats without prompting with this strategy, '
+                        'e.g. shortest, fewest_naming or ancestor:fvTenant')
+    parser.add_argument('--dn-lock', help='lock file recording DN choices, reused by later runs and meta_diff.py; '
+                        'by default {} in the output directory'.format(LOCK_NAME))
+    parser.add_argument('--dn-limit', type=int, default=DN_LIMIT, help='maximum number of DN formats listed for a '
+                        'class, shortest first (0 for all); choices missing from them fail')
+    parser.add_argument('--report', help='write per phase and per class timings as json to this path')
+    parser.add_argument('--metrics', help='write per phase and per class timings in Prometheus text format to this path')
+    parser.add_argument('--profile', type=int, metavar='N', help='run every class under cProfile and keep the stats '
+                        'of the N slowest')
+    parser.add_argument('--profile-dir', default='profile', help='directory for the cProfile stats of --profile')
 
     # verify args
     args = parser.parse_args()
-    if not args.klass and not args.list:
-        parser.error("--class or --list required")
-    elif args.klass and args.list:
-        parser.error("only one of --class or --list required")
+    if sum(map(bool, [args.klass, args.list, args.all])) != 1:
+        parser.error("one of --class, --list or --all required")
+    if args.all and not args.meta:
+        parser.error("--all requires --meta")
+    if (args.offline or args.seed_pages) and not args.cache_dir:
+        parser.error("--offline and --seed-pages require --cache-dir")
+    if args.dn_limit < 0:
+        parser.error("--dn-limit must not be negative")
 
     # get list of classes to generate modules for
+    class_filter = None
     if args.klass:
         classes = [args.klass]
-    else:
+    elif args.list:
         with open(args.list, 'r') as l:
             classes = list(map(lambda x: x.strip(), l.readlines()))
-
-    if args.meta:
+    else:
+        classes = None
+        class_filter = {'packages': args.include_package,
+                        'exclude_packages': args.exclude_package,
+                        'configurable': None if args.configurable is None else args.configurable == 'true',
+                        'abstract': None if args.abstract is None else args.abstract == 'true',
+                        'under': args.under}
+
+    # keep a bounded number of decoded classes when streaming over the whole model
+    meta = open_store(args.meta, cache_size=ALL_CACHE_SIZE if args.all else None) if args.meta else None
+    if args.all and meta is None:
+        meta = MetaStore(indexed_copy(args.meta), cache_size=ALL_CACHE_SIZE)
+    if args.meta and meta is None:
         with open(args.meta, 'r') as m:
             meta = m.read()
+
+    # the containment graph is saved next to the meta for later runs
+    graph = ContainmentGraph.cached(args.meta, meta if isinstance(meta, Mapping) else None) if args.under else None
+
+    if args.cache_dir and not meta:
+        cache = DocCache(args.cache_dir, ttl=args.cache_ttl, max_bytes=args.cache_size * 1024 * 1024,
+                         offline=args.offline)
+        if args.seed_pages:
+            cache.seed(args.seed_pages, args.doc_url)
     else:
-        meta = None
+        cache = None
+
+    # DN choices are kept next to the build manifest, where meta_diff.py finds them
+    dn_lock = args.dn_lock
+    if dn_lock is None and not is_archive(args.output):
+        dn_lock = os.path.join(args.output, LOCK_NAME)
+    if args.dn_policy:
+        policy = DNPolicy.from_file(args.dn_policy, dn_lock)
+        if args.dn_strategy:
+            policy.default = args.dn_strategy
+    elif args.dn_strategy or args.dn_lock:
+        policy = DNPolicy(default=args.dn_strategy or DEFAULT_STRATEGY, lock_path=dn_lock)
+    elif args.all:
+        policy = DNPolicy(lock_path=dn_lock) # prompting for every class of the model is not practical
+    else:
+        policy = None
 
-    classes = ansible_model(classes, meta)
+    if args.report or args.metrics or args.profile:
+        profiler = instrumentation.enable(args.profile_dir if args.profile else None)
+    else:
+        profiler = None
+
+    options = {}
+    if args.aggregate:
+        options['aggregate'] = True
+    if args.thin:
+        options['thin'] = True
+    options = options or None
+
+    # an archive is written anew, so it has no manifest to compare with
+    sink = open_sink(args.output)
+    if isinstance(sink, DirectorySink):
+        sink.fsync = not args.no_fsync
+        manifest = BuildManifest(os.path.join(args.output, MANIFEST_NAME))
+    else:
+        manifest = BuildManifest(None)
+
+    errors = {}
+    skipped = []
+    index = open(args.index, 'w') if args.index else None
+    try:
+        with sink:
+            classes = ansible_model(classes, meta, cache, args.doc_url, args.fetch_workers, args.fetch_rate,
+                                    args.jobs, errors, manifest, args.force, policy, class_filter, index, graph,
+                                    options, sink, args.dn_limit or None, skipped)
+            if args.thin:
+                write_runtime(sink)
+    finally:
+        if index is not None:
+            index.close()
+    manifest.save()
+    if policy is not None:
+        policy.save()
+    if cache is not None:
+        cache.flush()
+    for out in manifest.rebuilt:
+        print("Rebuilt {}".format(out))
+    print("{} modules rebuilt, {} unchanged".format(len(manifest.rebuilt), len(manifest.unchanged)))
+    if skipped:
+        print("{} classes without a DN skipped, listed in module.log".format(len(skipped)))
+    invalid = 0
+    if args.validate:
+        import validate # needs PyYAML, only required with --validate
+        names = manifest.rebuilt + manifest.unchanged + ([RUNTIME_PATH] if args.thin else [])
+        with instrumentation.phase('validate'):
+            results = validate.validate(validate.read_sources(args.output, names), args.jobs)
+        if profiler is not None:
+            for out, problems, seconds in results:
+                if out.startswith('auto_'):
+                    profiler.merge(out[len('auto_'):-len('.py')], {'validate': [seconds, 1]})
+        invalid = validate.report(results, out=sys.stderr)
+        print("{} modules valid, {} invalid".format(len(results) - invalid, invalid))
+    if profiler is not None:
+        if args.report:
+            profiler.write_json(args.report)
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                f.write(profiler.prometheus())
+        if args.profile:
+            totals = profiler.class_totals()
+            for path in profiler.keep_slowest_profiles(args.profile):
+                klass = os.path.basename(path)[:-len('.prof')]
+                print("{:.3f}s {} (cProfile stats in {})".format(totals[klass], klass, path))
+    for klass, error in errors.items():
+        print("Failed to create module for {}: {}".format(klass, error), file=sys.stderr)
     # with open(args.list, 'w') as n:
     #     n.write('\n'.join(classes))
+    if errors or invalid:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of the generator pipeline on synthetic ACI meta
+
+Builds an aci-meta.json model of a chosen size and shape, times each stage
+of module generation on it and the end-to-end ansible_model run, and
+compares the results with a stored baseline. Everything runs offline.
+
+Model shape:
+    polUni - fvTenant - <wide> classes under the tenant, each with <props> properties
+                      - a chain of <deep> nested classes
+    a fault-like class contained by every class above (<wide> + <deep> + 2 containers)
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import ansible_generator
+from dn_policy import DNPolicy
+from meta_store import MetaStore
+from object_model import MIM
+
+# relative slowdown of a stage against the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def synthetic_class(name, rn, naming, containers, contains, props):
+    properties = {'descr': {'isConfigurable': True, 'help': 'Description', 'options': [], 'label': 'Description'},
+                  'status': {'isConfigurable': True, 'help': 'Status', 'options': ['created', 'deleted', 'modified'],
+                             'label': 'Status'},
+                  'lcOwn': {'isConfigurable': False, 'help': 'Owner', 'options': ['local', 'policy'], 'label': 'Owner'}}
+    for i in range(props):
+        properties['prop{}'.format(i)] = {'isConfigurable': i % 2 == 0,
+                                          'help': 'Property {} of {}'.format(i, name),
+                                          'options': ['opt{}'.format(j) for j in range(i % 5)],
+                                          'label': 'Property {}'.format(i)}
+    for prop in naming:
+        properties[prop] = {'isConfigurable': True, 'help': 'Name', 'options': [], 'label': 'Name'}
+    return {'label': name[2:], 'name': name[:2] + ':' + name[2:], 'help': 'Synthetic class ' + name,
+            'isAbstract': False, 'isConfigurable': True, 'isDeletable': True,
+            'identifiedBy': naming, 'rnFormat': rn, 'properties': properties,
+            'containers': {c: '' for c in containers}, 'contains': {c: '' for c in contains}}
+
+
+def synthetic_meta(wide=50, deep=8, props=20):
+    """
+    Parameters
+    ----------
+    wide : int
+        number of classes directly under fvTenant
+    deep : int
+        length of the chain of nested classes under fvTenant
+    props : int
+        number of extra properties per class
+    Returns
+    -------
+    dict
+        meta in the form of aci-meta.json
+    """
+    classes = {}
+    wide_names = ['fvWide{}'.format(i) for i in range(wide)]
+    deep_names = ['fvDeep{}'.format(i) for i in range(deep)]
+    fault_containers = ['polUni', 'fvTenant'] + wide_names + deep_names
+
+    classes['topRoot'] = synthetic_class('topRoot', '', [], [], ['polUni'], 0)
+    classes['polUni'] = synthetic_class('polUni', 'uni', [], ['topRoot'], ['fvTenant', 'faultSynth'], 0)
+    classes['fvTenant'] = synthetic_class('fvTenant', 'tn-{name}', ['name'], ['polUni'],
+                                          wide_names + deep_names[:1] + ['faultSynth'], props)
+    for name in wide_names:
+        classes[name] = synthetic_class(name, name.lower() + '-{name}', ['name'], ['fvTenant'], ['faultSynth'], props)
+    for i, name in enumerate(deep_names):
+        parent = deep_names[i - 1] if i else 'fvTenant'
+        children = deep_names[i + 1:i + 2] + ['faultSynth']
+        classes[name] = synthetic_class(name, name.lower() + '-{name}', ['name'], [parent], children, props)
+    classes['faultSynth'] = synthetic_class('faultSynth', 'fault-{code}', ['code'], fault_containers, [], props)
+    return {'classes': classes}
+
+
+def measure(func, repeat, setup=None):
+    """
+    returns (seconds per call, peak bytes allocated) of func
+    the time is the fastest of repeat calls made without tracemalloc, which
+    slows allocations down; the peak comes from one more call, traced
+    setup, if given, is called before each call, untimed and untraced, and
+    its result passed to func
+    """
+    best = None
+    for _ in range(repeat):
+        args = (setup(),) if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    args = (setup(),) if setup is not None else ()
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def _load_store(path):
+    """builds a MIM over the meta store at path, then closes the store"""
+    store = MetaStore(path)
+    try:
+        return MIM(store)
+    finally:
+        store.close()
+
+
+def run(meta, repeat=5):
+    """
+    Times every stage of the pipeline on a meta dict
+    Returns
+    -------
+    dict
+        stage name mapped to {'seconds', 'per_second', 'peak_bytes', 'items'}
+    """
+    meta_text = json.dumps(meta)
+    class_names = [name for name in meta['classes'] if name != 'topRoot']
+    targets = [name for name in class_names if name.startswith('fv')]
+    results = {}
+
+    def record(stage, items, func, times=repeat, setup=None):
+        seconds, peak = measure(func, times, setup)
+        results[stage] = {'seconds': seconds, 'per_second': items / seconds if seconds else 0,
+                          'peak_bytes': peak, 'items': items}
+
+    tmp = tempfile.mkdtemp(prefix='autogen-bench-')
+    cwd = os.getcwd()
+    try:
+        store_json = os.path.join(tmp, 'aci-meta.json')
+        with open(store_json, 'w') as f:
+            f.write(meta_text)
+        store_path = os.path.join(tmp, 'aci-meta.idx')
+        MetaStore.convert(store_json, store_path)
+
+        record('meta_load_json', 1, lambda: MIM(meta_text))
+        record('meta_load_store', 1, lambda: _load_store(store_path))
+
+        # a MIM over freshly decoded records, so that class lookups enumerate DNs
+        fresh = lambda: MIM(json.loads(meta_text)['classes'])
+        record('get_class', len(class_names), lambda mim: [mim.get_class(name) for name in class_names], setup=fresh)
+        record('add_dn', 1, lambda mim: mim._add_dn('faultSynth'), setup=fresh)
+
+        mim = MIM(meta_text)
+
+        policy = DNPolicy()
+        mos = [mim.get_class(name) for name in targets]
+        choices = [policy.choose(mo) for mo in mos]
+
+        # the parameters are built untimed; every run starts without the ancestor
+        # entries memoized by earlier runs, as a generator run does
+        def parameters():
+            keys = [ansible_generator.get_ansible_context(mim, mo, choice)['keys'] for mo, choice in zip(mos, choices)]
+            ansible_generator._fragments.clear()
+            return keys
+
+        def hierarchy(keys):
+            for mo, choice, all_parameters in zip(mos, choices, keys):
+                ansible_generator.set_hierarchy(all_parameters, mo.dnFormat[choice][1], mim, mo.klass)
+        record('set_hierarchy', len(mos), hierarchy, setup=parameters)
+
+        contexts = []
+        def context(_):
+            del contexts[:]
+            for mo, choice in zip(mos, choices):
+                contexts.append(ansible_generator.get_ansible_context(mim, mo, choice))
+        record('get_ansible_context', len(mos), context, setup=ansible_generator._fragments.clear)
+
+        for ctx in contexts:
+            ctx['filename'] = 'auto_{}.py'.format(ctx['class'])
+        record('render', len(contexts),
+               lambda: [ansible_generator.render('ansible_2.6_read_write.py.j2', ctx) for ctx in contexts])
+
+        os.chdir(tmp)
+        record('ansible_model', len(targets),
+               lambda: ansible_generator.ansible_model(targets, meta_text, policy=DNPolicy()), times=1)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """returns the stages slower than the baseline by more than tolerance"""
+    regressions = []
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        if base and result['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append(stage)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the generator pipeline on synthetic meta')
+    parser.add_argument('--wide', type=int, default=50, help='classes directly under fvTenant')
+    parser.add_argument('--deep', type=int, default=8, help='length of the nested class chain')
+    parser.add_argument('--props', type=int, default=20, help='extra properties per class')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each stage')
+    parser.add_argument('--write-meta', help='also write the synthetic aci-meta.json to this path')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--save', help='write the results as json to this path')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    meta = synthetic_meta(args.wide, args.deep, args.props)
+    if args.write_meta:
+        with open(args.write_meta, 'w') as f:
+            json.dump(meta, f)
+
+    results = run(meta, args.repeat)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+
+    print("{:20} {:>12} {:>14} {:>12} {:>10}".format('stage', 'ms', 'items/s', 'peak KiB', 'baseline'))
+    for stage, result in results.items():
+        base = baseline.get(stage)
+        change = "{:+.0%}".format(result['seconds'] / base['seconds'] - 1) if base else ''
+        print("{:20} {:12.2f} {:14.1f} {:12.1f} {:>10}{}".format(
+            stage, result['seconds'] * 1000, result['per_second'], result['peak_bytes'] / 1024.0,
+            change, '  REGRESSION' if stage in regressions else ''))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Build manifest for incremental module generation
+
+Records, for every generated file, a hash over the inputs that produced
+it: the class record, the records of the classes in its chosen DN, the DN
+itself, the template and its options and the generator version. A module
+whose inputs hash the same as in the manifest, and whose file still
+exists, does not need to be rendered again.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = '.autogen-manifest.json'
+
+
+def input_hash(records, dn, template_hash, version, options=None):
+    """
+    Parameters
+    ----------
+    records : list
+        meta records of the class followed by its DN classes
+    dn : str
+        chosen DN format, None for abstract classes
+    template_hash : str
+        hash of the template source
+    version : int
+        generator version
+    options : dict
+        template options, if any
+    Returns
+    -------
+    str
+        sha256 hex digest over all inputs
+    """
+    # dnFormat is derived from the containment of other classes; the DN
+    # actually used is hashed on its own
+    records = [{key: value for key, value in record.items() if key != 'dnFormat'} for record in records]
+    inputs = [records, dn, template_hash, version]
+    if options:
+        inputs.append(options) # only when given, so that earlier hashes stay valid
+    data = json.dumps(inputs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """
+    Instance represents the manifest file of an output directory
+    """
+
+    def __init__(self, path=MANIFEST_NAME):
+        """
+        Parameters
+        ----------
+        path : str
+            manifest file, read if it exists; None for a manifest kept in memory
+        """
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.outputs = json.load(f)['outputs']
+        except (IOError, ValueError, KeyError, TypeError):
+            self.outputs = {}
+        self.rebuilt = []
+        self.unchanged = []
+
+    def is_current(self, out, digest, sink=None):
+        """
+        returns True if out exists and was generated from inputs hashing to digest
+        existence is checked with sink.exists if a sink (see output_sink.py) is
+        provided, else next to the manifest file
+        """
+        entry = self.outputs.get(out)
+        if entry is None or entry['hash'] != digest:
+            return False
+        if sink is not None:
+            return sink.exists(out)
+        return self.path is not None and os.path.exists(os.path.join(os.path.dirname(self.path), out))
+
+    def record(self, out, digest, klass, classes, built):
+        """
+        Parameters
+        ----------
+        out : str
+            generated file name
+        digest : str
+            input hash of the file
+        klass : str
+            class of the module
+        classes : list
+            classes of the chosen DN, empty for abstract classes
+        built : bool
+            True if the file was rendered in this run
+        """
+        self.outputs[out] = {'hash': digest, 'class': klass, 'classes': classes}
+        (self.rebuilt if built else self.unchanged).append(out)
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'outputs': self.outputs}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
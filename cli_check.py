@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+End to end check of the command line tools
+
+Runs the tools the way a user does, each in a scratch directory, and checks
+their exit status and the files they leave behind:
+
+- ansible_generator.py --all over the whole meta exits 0, classes without a
+  DN (such as topRoot) being skipped rather than failed
+- meta_diff.py --generate, run from another directory after the help of a
+  class changed, rewrites its module next to the manifest and nowhere else,
+  and refuses to run without the DN lock file of the modules
+- ansible_generator.py --thin ships less than the fat modules: every thin
+  module is smaller than the fat one of its class and leaves the request
+  helpers to the module_utils runtime, and the thin modules with the runtime
+  are smaller than the fat modules together
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from build_manifest import MANIFEST_NAME
+from dn_policy import LOCK_NAME
+from meta_store import load_classes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(tool, args, cwd, python=sys.executable):
+    """runs tool (a script next to this one) with args in cwd; returns (exit status, output)"""
+    process = subprocess.run([python, os.path.join(HERE, tool)] + args, cwd=cwd, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, universal_newlines=True)
+    return process.returncode, process.stdout
+
+
+def check_all(meta, tmp):
+    """returns (check, problem or None) of generating every class of meta"""
+    output = os.path.join(tmp, 'all')
+    os.mkdir(output)
+    status, out = run('ansible_generator.py', ['-m', meta, '--all', '-o', output], tmp)
+    modules = [name for name in os.listdir(output) if name.startswith('auto_')]
+    if status != 0:
+        problem = 'exit status {}: {}'.format(status, out.strip()[-400:])
+    elif not modules:
+        problem = 'no modules written'
+    else:
+        problem = None
+    return [('generate --all', problem)]
+
+
+def check_meta_diff(meta, tmp):
+    """returns (check, problem or None) of regenerating the modules of check_all after a meta change"""
+    output = os.path.join(tmp, 'all')
+    manifest = os.path.join(output, MANIFEST_NAME)
+    with open(manifest, 'r') as f:
+        outputs = json.load(f)['outputs']
+    out = sorted(outputs)[0]
+    classes = dict(load_classes(meta))
+    classes[outputs[out]['class']] = dict(classes[outputs[out]['class']], help='Changed help text')
+    new = os.path.join(tmp, 'new-meta.json')
+    with open(new, 'w') as f:
+        json.dump({'classes': classes}, f)
+    elsewhere = os.path.join(tmp, 'elsewhere')
+    os.mkdir(elsewhere)
+
+    results = []
+    status, text = run('meta_diff.py', [meta, new, '--manifest', manifest, '--generate'], elsewhere)
+    with open(os.path.join(output, out), 'r') as f:
+        module = f.read()
+    if status != 0:
+        problem = 'exit status {}: {}'.format(status, text.strip()[-400:])
+    elif 'Changed help text' not in module:
+        problem = '{} not regenerated'.format(out)
+    elif any(name.startswith('auto_') for name in os.listdir(elsewhere)):
+        problem = 'modules written to the working directory'
+    else:
+        problem = None
+    results.append(('meta_diff --generate next to the manifest', problem))
+
+    os.remove(os.path.join(output, LOCK_NAME))
+    status, text = run('meta_diff.py', [meta, new, '--manifest', manifest, '--generate'], elsewhere)
+    results.append(('meta_diff --generate without DN lock refused',
+                    None if status != 0 and LOCK_NAME in text else 'exit status {}'.format(status)))
+    return results
+
+
+def check_payload(meta, tmp):
+    """returns (check, problem or None) of the size of thin modules against fat ones, printing the sizes"""
+    sizes = {}
+    for kind, options in (('fat', []), ('thin', ['--thin'])):
+        output = os.path.join(tmp, kind)
+        os.mkdir(output)
+        status, out = run('ansible_generator.py', ['-m', meta, '--all', '--aggregate', '-o', output] + options, tmp)
+        if status != 0:
+            return [('thin payload', '{} run exit status {}: {}'.format(kind, status, out.strip()[-400:]))]
+        sizes[kind] = dict((name, os.path.getsize(os.path.join(output, name)))
+                           for name in os.listdir(output) if name.startswith('auto_'))
+    runtime = os.path.getsize(os.path.join(tmp, 'thin', 'module_utils', 'aci_autogen.py'))
+    fat, thin = sum(sizes['fat'].values()), sum(sizes['thin'].values())
+    print("{} modules: fat {} bytes, thin {} bytes and runtime {} bytes".format(len(sizes['fat']), fat, thin, runtime))
+
+    larger = [name for name, size in sizes['thin'].items() if size >= sizes['fat'].get(name, 0)]
+    helpers = []
+    for name in sizes['thin']:
+        with open(os.path.join(tmp, 'thin', name), 'r') as f:
+            if 'def aci_request(' in f.read():
+                helpers.append(name)
+    if larger:
+        problem = 'thin modules not smaller: {}'.format(', '.join(sorted(larger)))
+    elif helpers:
+        problem = 'thin modules defining aci_request: {}'.format(', '.join(sorted(helpers)))
+    elif thin + runtime >= fat:
+        problem = 'thin modules and runtime ({} bytes) not smaller than fat modules ({} bytes)'.format(
+            thin + runtime, fat)
+    else:
+        problem = None
+    return [('thin payload', problem)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the command line tools end to end')
+    parser.add_argument('-m', '--meta', required=True, help='aci meta json file or meta store')
+    args = parser.parse_args()
+
+    meta = os.path.abspath(args.meta)
+    tmp = tempfile.mkdtemp(prefix='cli-check-')
+    try:
+        results = check_all(meta, tmp)
+        results += check_meta_diff(meta, tmp)
+        results += check_payload(meta, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    failures = 0
+    for check, problem in results:
+        if problem:
+            failures += 1
+            print("FAIL {}: {}".format(check, problem))
+    print("{} of {} checks passed".format(len(results) - failures, len(results)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
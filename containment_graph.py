@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Containment graph of the ACI meta
+
+Every class name is interned to an integer ID (its position in the sorted
+list of names) and the containment edges are held in compressed sparse row
+form in both directions: for class i, the IDs of its containers are
+up_ids[up_offsets[i]:up_offsets[i + 1]], those of the classes it contains
+down_ids[down_offsets[i]:down_offsets[i + 1]]. An edge exists if either end
+lists the other, in 'contains' or 'containers'.
+
+The graph is built with one pass over the meta and can be saved next to it;
+ContainmentGraph.cached reuses the saved graph as long as the meta file is
+unchanged.
+
+Layout of a saved graph:
+    MAGIC (8 bytes) | header length (8 bytes, big endian) | header | arrays
+where header is a JSON object with the class names, the byte order and
+length of the arrays and the size and mtime of the meta it was built from.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+from array import array
+from collections import deque
+
+from meta_store import SHARD_INDEX, load_classes
+
+MAGIC = b'ACIGRPH1'
+_HEADER = struct.Struct('>8sQ')
+_ARRAYS = ('up_offsets', 'up_ids', 'down_offsets', 'down_ids')
+
+ROOT = 'topRoot'
+
+
+def _csr(count, edges):
+    """returns (offsets, ids) arrays of adjacency lists given as {id: set of ids}"""
+    offsets = array('i', [0])
+    ids = array('i')
+    for i in range(count):
+        targets = sorted(edges.get(i, ()))
+        ids.extend(targets)
+        offsets.append(len(ids))
+    return offsets, ids
+
+
+class ContainmentGraph:
+    """
+    Instance is an immutable containment graph over interned class IDs
+    """
+
+    def __init__(self, names, up_offsets, up_ids, down_offsets, down_ids):
+        """
+        Parameters
+        ----------
+        names : list
+            class names, sorted; the index of a name is its ID
+        up_offsets, up_ids : array
+            CSR adjacency of container IDs
+        down_offsets, down_ids : array
+            CSR adjacency of contained class IDs
+        """
+        self.names = names
+        self.ids = {name: i for i, name in enumerate(names)}
+        self.up_offsets = up_offsets
+        self.up_ids = up_ids
+        self.down_offsets = down_offsets
+        self.down_ids = down_ids
+        self._depth = None
+
+    @classmethod
+    def from_meta(cls, classes):
+        """
+        Parameters
+        ----------
+        classes : Mapping
+            classes of the meta, e.g. MIM.meta
+        Returns
+        -------
+        ContainmentGraph
+        """
+        edges = set() # (container, contained)
+        for class_name in classes:
+            record = classes[class_name]
+            edges.update((container, class_name) for container in record.get('containers', {}))
+            edges.update((class_name, contained) for contained in record.get('contains', {}))
+        names = sorted(set(classes) | {name for edge in edges for name in edge})
+        ids = {name: i for i, name in enumerate(names)}
+        up, down = {}, {}
+        for container, contained in edges:
+            up.setdefault(ids[contained], set()).add(ids[container])
+            down.setdefault(ids[container], set()).add(ids[contained])
+        return cls(names, *(_csr(len(names), up) + _csr(len(names), down)))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, class_name):
+        return class_name in self.ids
+
+    def _id(self, class_name):
+        try:
+            return self.ids[class_name]
+        except KeyError:
+            raise KeyError("{} is not in the containment graph".format(class_name))
+
+    def _up(self, i):
+        return self.up_ids[self.up_offsets[i]:self.up_offsets[i + 1]]
+
+    def _down(self, i):
+        return self.down_ids[self.down_offsets[i]:self.down_offsets[i + 1]]
+
+    def containers(self, class_name):
+        """returns the names of the direct containers of a class"""
+        return [self.names[j] for j in self._up(self._id(class_name))]
+
+    def contains(self, class_name):
+        """returns the names of the classes a class directly contains"""
+        return [self.names[j] for j in self._down(self._id(class_name))]
+
+    def _closure(self, start, step):
+        seen = bytearray(len(self.names))
+        stack = [start]
+        found = []
+        while stack:
+            for j in step(stack.pop()):
+                if not seen[j]:
+                    seen[j] = 1
+                    found.append(j)
+                    stack.append(j)
+        return found
+
+    def ancestors(self, class_name):
+        """returns the set of classes containing class_name, directly or not"""
+        return {self.names[j] for j in self._closure(self._id(class_name), self._up)}
+
+    def descendants(self, class_name):
+        """returns the set of classes contained by class_name, directly or not"""
+        return {self.names[j] for j in self._closure(self._id(class_name), self._down)}
+
+    def depth(self, class_name):
+        """
+        Returns
+        -------
+        int
+            fewest containment edges between topRoot and the class (0 for
+            topRoot itself), None if the class is not under topRoot
+        """
+        if self._depth is None:
+            self._depth = array('i', [-1]) * len(self.names)
+            if ROOT in self.ids:
+                root = self.ids[ROOT]
+                self._depth[root] = 0
+                queue = deque([root])
+                while queue:
+                    i = queue.popleft()
+                    for j in self._down(i):
+                        if self._depth[j] < 0:
+                            self._depth[j] = self._depth[i] + 1
+                            queue.append(j)
+        depth = self._depth[self._id(class_name)]
+        return None if depth < 0 else depth
+
+    def reachable(self, ancestor, class_name):
+        """returns True if class_name is contained by ancestor, directly or not"""
+        return self.path(ancestor, class_name) is not None
+
+    def path(self, ancestor, class_name):
+        """
+        Returns
+        -------
+        list
+            class names of a shortest containment path from ancestor down to
+            class_name, both included; None if there is none
+        """
+        start, end = self._id(ancestor), self._id(class_name)
+        parent = array('i', [-1]) * len(self.names)
+        parent[start] = start
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            if i == end:
+                path = [i]
+                while i != start:
+                    i = parent[i]
+                    path.append(i)
+                return [self.names[j] for j in reversed(path)]
+            for j in self._down(i):
+                if parent[j] < 0:
+                    parent[j] = i
+                    queue.append(j)
+        return None
+
+    def save(self, path, stamp=None):
+        """
+        Parameters
+        ----------
+        path : str
+            graph file to write
+        stamp : list
+            identifies the meta the graph was built from (see cached)
+        """
+        header = {'names': self.names, 'byteorder': sys.byteorder, 'stamp': stamp,
+                  'lengths': [len(getattr(self, name)) for name in _ARRAYS]}
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, len(header_bytes)))
+            out.write(header_bytes)
+            for name in _ARRAYS:
+                getattr(self, name).tofile(out)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, stamp=None):
+        """
+        Returns
+        -------
+        ContainmentGraph
+            graph saved at path, None if stamp is provided and differs from the saved one
+        """
+        with open(path, 'rb') as f:
+            magic, header_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("{} is not a containment graph file".format(path))
+            header = json.loads(f.read(header_len).decode('utf-8'))
+            if stamp is not None and header['stamp'] != stamp:
+                return None
+            arrays = []
+            for length in header['lengths']:
+                a = array('i')
+                a.fromfile(f, length)
+                if header['byteorder'] != sys.byteorder:
+                    a.byteswap()
+                arrays.append(a)
+        return cls(header['names'], *arrays)
+
+    @staticmethod
+    def graph_path(meta_path):
+        """returns where the graph of a meta file or shard directory is saved"""
+        if os.path.isdir(meta_path):
+            return os.path.join(meta_path, 'containment.graph')
+        return meta_path + '.graph'
+
+    @classmethod
+    def cached(cls, meta_path, classes=None):
+        """
+        Returns the graph saved next to meta_path if it was built from the
+        meta as it is now, otherwise builds it (from classes if provided,
+        else by loading meta_path) and saves it
+
+        Returns
+        -------
+        ContainmentGraph
+        """
+        source = os.path.join(meta_path, SHARD_INDEX) if os.path.isdir(meta_path) else meta_path
+        info = os.stat(source)
+        stamp = [info.st_size, info.st_mtime_ns]
+        graph_path = cls.graph_path(meta_path)
+        if os.path.exists(graph_path):
+            graph = cls.load(graph_path, stamp)
+            if graph is not None:
+                return graph
+        graph = cls.from_meta(classes if classes is not None else load_classes(meta_path))
+        graph.save(graph_path, stamp)
+        return graph
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build and query the containment graph of the ACI meta')
+    parser.add_argument('meta', help='aci meta json file or meta store; the graph is cached next to it')
+    parser.add_argument('--ancestors', metavar='CLASS', help='list the classes containing CLASS')
+    parser.add_argument('--descendants', metavar='CLASS', help='list the classes contained by CLASS')
+    parser.add_argument('--depth', metavar='CLASS', help='print the depth of CLASS below topRoot')
+    parser.add_argument('--path', nargs=2, metavar=('ANCESTOR', 'CLASS'),
+                        help='print a shortest containment path from ANCESTOR to CLASS')
+    args = parser.parse_args()
+
+    graph = ContainmentGraph.cached(args.meta)
+    if args.ancestors:
+        print('\n'.join(sorted(graph.ancestors(args.ancestors))))
+    elif args.descendants:
+        print('\n'.join(sorted(graph.descendants(args.descendants))))
+    elif args.depth:
+        print(graph.depth(args.depth))
+    elif args.path:
+        path = graph.path(*args.path)
+        print(' > '.join(path) if path else "{} is not under {}".format(args.path[1], args.path[0]))
+    else:
+        print("{} classes, {} containment edges in {}".format(
+            len(graph), len(graph.down_ids), ContainmentGraph.graph_path(args.meta)))
+
+
+if __name__ == '__main__':
+    main()
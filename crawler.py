@@ -0,0 +1,132 @@
+"""
+Concurrent prefetch of online class documentation
+
+Crawls outward from the requested classes through their containers and DN
+classes with a bounded pool of threads sharing one pooled, rate limited
+session, then adds every class found to MIM.meta at once. Afterwards the
+hierarchy build only hits memory instead of issuing one blocking request
+per DN ancestor.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+
+
+class RateLimiter:
+    """Spaces out calls to wait() so that at most rate of them start per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class RateLimitedSession(requests.Session):
+    """Session whose requests go through a RateLimiter"""
+
+    def __init__(self, limiter, pool_size):
+        requests.Session.__init__(self)
+        self.limiter = limiter
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, *args, **kwargs):
+        self.limiter.wait()
+        return requests.Session.request(self, *args, **kwargs)
+
+
+def linked_classes(class_dict):
+    """returns the names of the classes a class entry links to on the way to topRoot"""
+    linked = list(class_dict.get('containers', {}))
+    for _, classes in class_dict.get('dnFormat', []):
+        linked.extend(classes)
+    return linked
+
+
+def prefetch(mim, classes, workers=DEFAULT_WORKERS, rate=None):
+    """
+    Fetches the documentation of classes and all of their ancestors into mim
+
+    Parameters
+    ----------
+    mim : MIM
+        model initialized without meta
+    classes : list
+        names of the requested classes
+    workers : int
+        maximum number of concurrent requests
+    rate : float
+        maximum number of requests started per second; unlimited if not provided
+    Returns
+    -------
+    dict
+        class names mapped to the error that prevented fetching them; these
+        classes are left for MIM.get_class to report
+    """
+    session = RateLimitedSession(RateLimiter(rate), workers)
+    # the cache fetches with the crawl session only for the duration of the crawl
+    original_session = mim.cache.session if mim.cache is not None else None
+    if mim.cache is not None:
+        mim.cache.session = session
+    try:
+        fetched, errors = _crawl(mim, classes, workers, session)
+    finally:
+        if mim.cache is not None:
+            mim.cache.session = original_session
+        session.close()
+
+    mim.meta.update(fetched)
+    logger.info("Prefetched {0} classes".format(len(fetched)))
+    return errors
+
+
+def _crawl(mim, classes, workers, session):
+    """returns the class entries fetched from classes outward and the errors of the classes that failed"""
+    fetched = {}
+    errors = {}
+    seen = set(mim.meta)
+    seen.add('topRoot')
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def submit(names):
+            for name in names:
+                if name not in seen:
+                    seen.add(name)
+                    pending[pool.submit(mim.fetch_class, name, session)] = name
+
+        submit(classes)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    class_dict = future.result()
+                except Exception as e: # including pages the parser cannot read
+                    logger.error("Failed to prefetch {0}: {1}".format(name, e))
+                    errors[name] = e
+                    continue
+                fetched[name] = class_dict
+                submit(linked_classes(class_dict))
+    return fetched, errors
@@ -0,0 +1,159 @@
+"""
+Non-interactive DN selection
+
+A DNPolicy picks one of the DN formats of a class without prompting. Rules
+are matched against the class name in order, falling back to the default
+strategy; every decision is recorded in a lock file, and classes found in
+the lock file keep their recorded DN as long as the class still has it.
+
+Heavily contained classes only list their first DNs (see object_model.DN_LIMIT).
+When a locked DN or a strategy finds no match among them, the choice is
+refused rather than made from the DNs listed, as the match may lie past the
+limit; shortest is not affected, as DNs are listed shortest first.
+
+Strategies:
+    shortest           fewest classes in the DN
+    fewest_naming      fewest naming properties in the DN
+    ancestor:<class>   first DN containing <class>, e.g. ancestor:fvTenant
+    index:<n>          n-th DN format (1 based) as listed interactively
+    dn:<format>        this exact DN format
+    prompt             ask on the terminal
+
+Rules file (json):
+    {"default": "shortest",
+     "rules": [{"match": "fv*", "strategy": "ancestor:fvTenant"},
+               {"match": "l3extOut", "strategy": "index:2"}]}
+"""
+
+import fnmatch
+import json
+import os
+import re
+
+from object_model import ModuleGenerationException
+
+DEFAULT_STRATEGY = 'shortest'
+
+# lock file kept next to the build manifest of an output directory
+LOCK_NAME = '.autogen-dn-lock.json'
+
+_naming = re.compile(r"\{.*?\}")
+
+
+def prompt_dn(mo):
+    """ask user to choose DN format; returns the index of the chosen entry of mo.dnFormat"""
+    if len(mo.dnFormat) > 1:
+        i = 1
+        for format in mo.dnFormat:
+            print("{}: {}".format(i, format[0]))
+            i += 1
+        if mo.dnLimit is not None:
+            print("(first {} DNs only, see --dn-limit)".format(mo.dnLimit))
+        return int(input("Enter number corresponding to desired DN format for {}\n".format(mo.klass)))-1
+    elif len(mo.dnFormat) == 0:
+        raise ModuleGenerationException("no DNs")
+    else:
+        return 0
+
+
+def apply_strategy(strategy, mo):
+    """
+    Parameters
+    ----------
+    strategy : str
+        one of the strategies listed in this module
+    mo : MO
+        class to choose a DN for
+    Returns
+    -------
+    int
+        index into mo.dnFormat, None if the strategy matches no DN
+    """
+    dns = mo.dnFormat
+    kind, _, arg = strategy.partition(':')
+    if kind == 'shortest':
+        return min(range(len(dns)), key=lambda i: len(dns[i][1]))
+    elif kind == 'fewest_naming':
+        return min(range(len(dns)), key=lambda i: len(_naming.findall(dns[i][0])))
+    elif kind == 'ancestor':
+        return next((i for i, (_, classes) in enumerate(dns) if arg in classes), None)
+    elif kind == 'index':
+        index = int(arg) - 1
+        return index if 0 <= index < len(dns) else None
+    elif kind == 'dn':
+        return next((i for i, (dn, _) in enumerate(dns) if dn == arg), None)
+    elif kind == 'prompt':
+        return prompt_dn(mo)
+    raise ModuleGenerationException("unknown DN strategy {}".format(strategy))
+
+
+class DNPolicy:
+    """
+    Instance chooses DN formats from rules and records the choices
+    """
+
+    def __init__(self, rules=None, default=DEFAULT_STRATEGY, lock_path=None):
+        """
+        Parameters
+        ----------
+        rules : list
+            dicts with keys 'match' (class name or fnmatch pattern) and 'strategy'
+        default : str
+            strategy used when no rule matches a DN
+        lock_path : str
+            lock file with recorded choices, read if it exists
+        """
+        self.rules = rules or []
+        self.default = default
+        self.lock_path = lock_path
+        self.lock = {}
+        if lock_path and os.path.exists(lock_path):
+            with open(lock_path, 'r') as f:
+                self.lock = json.load(f)
+
+    @classmethod
+    def from_file(cls, path, lock_path=None):
+        """creates a policy from a json rules file"""
+        with open(path, 'r') as f:
+            config = json.load(f)
+        return cls(config.get('rules', []), config.get('default', DEFAULT_STRATEGY), lock_path)
+
+    def choose(self, mo):
+        """
+        Parameters
+        ----------
+        mo : MO
+            class to choose a DN for
+        Returns
+        -------
+        int
+            index into mo.dnFormat
+        """
+        if len(mo.dnFormat) == 0:
+            raise ModuleGenerationException("no DNs")
+
+        locked = self.lock.get(mo.klass)
+        if locked is not None:
+            choice = apply_strategy('dn:' + locked, mo)
+            if choice is not None:
+                return choice
+            if mo.dnLimit is not None:
+                raise ModuleGenerationException("locked DN {} is not among the first {} DNs of {}, raise --dn-limit".format(
+                    locked, mo.dnLimit, mo.klass))
+
+        strategies = [rule['strategy'] for rule in self.rules if fnmatch.fnmatchcase(mo.klass, rule['match'])]
+        for strategy in strategies + [self.default]:
+            choice = apply_strategy(strategy, mo)
+            if choice is not None:
+                self.lock[mo.klass] = mo.dnFormat[choice][0]
+                return choice
+            if mo.dnLimit is not None:
+                raise ModuleGenerationException("no DN among the first {} DNs of {} matches {}, raise --dn-limit".format(
+                    mo.dnLimit, mo.klass, strategy))
+        raise ModuleGenerationException("no DN of {} matches {}".format(mo.klass, ', '.join(strategies + [self.default])))
+
+    def save(self):
+        """writes the recorded choices to the lock file"""
+        if self.lock_path:
+            with open(self.lock_path, 'w') as f:
+                json.dump(self.lock, f, indent=2, sort_keys=True)
@@ -0,0 +1,278 @@
+"""
+Persistent on-disk cache for the online MIM documentation
+
+Pages are stored content-addressed by the sha256 of their html, and parsed
+class entries are stored next to the page they came from, keyed by the page
+hash and the parser version. An index maps each URL to its page hash, ETag
+and fetch time; stale entries are revalidated with conditional requests and
+the least recently used entries are evicted once the cache grows past its
+size limit.
+
+Layout:
+    index.json
+    pages/<sha256>.html
+    parsed/<sha256>-v<parser version>.json
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+
+from object_model import CacheMissException, InvalidURLException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 7 * 24 * 3600 # seconds before a page is revalidated
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+FLUSH_INTERVAL = 30 # seconds between index writes while pages are being stored
+
+_page_name = re.compile(r"MO-(\w+)\.html$")
+
+
+class DocCache:
+    """
+    Instance represents a directory caching documentation pages and the
+    class entries parsed from them
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False, session=None):
+        """
+        Parameters
+        ----------
+        path : str
+            cache directory, created if missing
+        ttl : int
+            seconds a page is served without revalidation
+        max_bytes : int
+            size limit of the cached pages and class entries
+        offline : bool
+            serve only cached pages, whatever their age, and never use the network
+        session : requests.Session
+            session used for requests; a new one if not provided
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.session = session if session is not None else requests.Session()
+        self._lock = threading.RLock()
+        os.makedirs(os.path.join(path, 'pages'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'parsed'), exist_ok=True)
+        self._index_path = os.path.join(path, 'index.json')
+        try:
+            with open(self._index_path, 'r') as f:
+                self._index = json.load(f)
+        except (IOError, ValueError):
+            self._index = {}
+        self._size = sum(entry['size'] for entry in self._index.values())
+        self._dirty = False
+        self._flushed = time.time()
+
+    def fetch(self, url):
+        """
+        Parameters
+        ----------
+        url : str
+            documentation page
+        Returns
+        -------
+        str
+            html of the page, from the cache when fresh
+        """
+        with open(self._page_path(self._resolve(url)), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def load(self, url, parse, version):
+        """
+        Parameters
+        ----------
+        url : str
+            documentation page
+        parse : function
+            turns the page html into a class entry
+        version : int
+            version of parse; entries from other versions are ignored
+        Returns
+        -------
+        dict
+            class entry parsed from the page, from the cache when the page is unchanged
+        """
+        digest = self._resolve(url)
+        parsed_path = os.path.join(self.path, 'parsed', '{}-v{}.json'.format(digest, version))
+        try:
+            with open(parsed_path, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            pass
+
+        with open(self._page_path(digest), 'r', encoding='utf-8') as f:
+            class_dict = parse(f.read())
+        self._write(parsed_path, json.dumps(class_dict, sort_keys=True))
+        with self._lock:
+            if url in self._index:
+                size = os.path.getsize(parsed_path)
+                self._index[url]['size'] += size
+                self._size += size
+                self._dirty = True
+            self._evict()
+        return class_dict
+
+    def seed(self, pages_dir, url_format):
+        """
+        Adds saved documentation pages to the cache
+
+        Parameters
+        ----------
+        pages_dir : str
+            directory of saved MO-<class>.html pages
+        url_format : str
+            URL of a class page, formatted with the class name
+        Returns
+        -------
+        int
+            number of pages added
+        """
+        count = 0
+        for page in sorted(glob.glob(os.path.join(pages_dir, 'MO-*.html'))):
+            match = _page_name.search(page)
+            if match is None:
+                continue
+            with open(page, 'r', encoding='utf-8') as f:
+                html = f.read()
+            self._store(url_format.format(match.group(1)), html, None)
+            count += 1
+        self.flush()
+        return count
+
+    def flush(self):
+        """
+        writes the index to disk if it changed, keeping the entries other
+        processes sharing the cache directory added in the meantime
+        """
+        with self._lock:
+            if self._dirty:
+                try:
+                    with open(self._index_path, 'r') as f:
+                        on_disk = json.load(f)
+                except (IOError, ValueError):
+                    on_disk = {}
+                for url, entry in on_disk.items():
+                    if url not in self._index and os.path.exists(self._page_path(entry['sha'])):
+                        self._index[url] = entry
+                        self._size += entry['size']
+                self._write(self._index_path, json.dumps(self._index, sort_keys=True))
+                self._dirty = False
+            self._flushed = time.time()
+
+    def __getstate__(self):
+        # sent to worker processes without the lock and the connection pool
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['session'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self.session = requests.Session()
+
+    def _flush_periodically(self):
+        """flushes the index if it was last written more than FLUSH_INTERVAL seconds ago"""
+        if time.time() - self._flushed >= FLUSH_INTERVAL:
+            self.flush()
+
+    def _resolve(self, url):
+        """returns the hash of a valid cached page for url, fetching or revalidating it as needed"""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is not None:
+                entry['atime'] = time.time()
+                self._dirty = True
+                fresh = time.time() - entry['fetched'] < self.ttl
+                if self.offline or fresh:
+                    return entry['sha']
+            elif self.offline:
+                raise CacheMissException("{} is not cached and the cache is offline".format(url))
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        try:
+            r = self.session.get(url, headers=headers)
+        except requests.RequestException as e:
+            if entry is None:
+                raise InvalidURLException("class documentation request failed: {}".format(e))
+            logger.warning("Serving stale page for {0}: {1}".format(url, e))
+            return entry['sha']
+
+        if r.status_code == 304 and entry is not None:
+            with self._lock:
+                entry['fetched'] = time.time()
+                self._dirty = True
+                self._flush_periodically()
+            return entry['sha']
+        if r.status_code != 200:
+            raise InvalidURLException("class documentation request failed")
+        return self._store(url, r.text, r.headers.get('ETag'))
+
+    def _store(self, url, html, etag):
+        """adds a page to the cache and returns its hash"""
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        page_path = self._page_path(digest)
+        if not os.path.exists(page_path):
+            self._write(page_path, data)
+        now = time.time()
+        with self._lock:
+            previous = self._index.get(url)
+            if previous is not None:
+                self._size -= previous['size']
+            self._index[url] = {'sha': digest,
+                                'etag': etag,
+                                'fetched': now,
+                                'atime': now,
+                                'size': len(data)}
+            self._size += len(data)
+            self._dirty = True
+            self._evict()
+            # rewriting the whole index for every page would make a crawl quadratic;
+            # flush() is also called once the run is over
+            self._flush_periodically()
+        return digest
+
+    def _evict(self):
+        """removes least recently used entries until the cache fits in max_bytes"""
+        if self._size <= self.max_bytes:
+            return
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1]['atime']):
+            if self._size <= self.max_bytes:
+                break
+            del self._index[url]
+            self._size -= entry['size']
+            if not any(other['sha'] == entry['sha'] for other in self._index.values()):
+                for path in [self._page_path(entry['sha'])] + \
+                        glob.glob(os.path.join(self.path, 'parsed', entry['sha'] + '-v*.json')):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        self._dirty = True
+
+    def _page_path(self, digest):
+        return os.path.join(self.path, 'pages', digest + '.html')
+
+    @staticmethod
+    def _write(path, data):
+        """writes a file atomically"""
+        mode = 'wb' if isinstance(data, bytes) else 'w'
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, mode) as f:
+            f.write(data)
+        os.replace(tmp, path)
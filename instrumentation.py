@@ -0,0 +1,195 @@
+"""
+Per-phase timing of module generation
+
+The generator records time spent in each phase (meta load, class lookup, DN
+enumeration, hierarchy build, render, file write and validation) through the
+module level profiler, attributing it to the class being generated. Phases
+may nest; each phase is charged its own time only, excluding nested phases.
+Recording is a no-op until enable() is called.
+
+Phase names are checked against PHASES, so that the phases of a report
+always come from the same set.
+"""
+
+import cProfile
+import json
+import os
+import time
+from contextlib import contextmanager
+
+PHASES = ['meta_load', 'class_lookup', 'dn_enumeration', 'hierarchy', 'render', 'file_write', 'validate']
+
+
+class Profiler:
+    """
+    Instance collects phase timings per class and counters for a run
+    """
+
+    def __init__(self, enabled=False, profile_dir=None):
+        """
+        Parameters
+        ----------
+        enabled : bool
+            record timings; phase() and count() do nothing otherwise
+        profile_dir : str
+            if provided, every class is run under cProfile and its stats
+            written to <profile_dir>/<class>.prof
+        """
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.classes = {} # class name -> {phase: [seconds, calls]}
+        self.counters = {}
+        self._current = None
+        self._stack = [] # [phase, start, time of nested phases]
+
+    @contextmanager
+    def phase(self, name):
+        """times the enclosed block as phase name of the current class"""
+        if name not in PHASES:
+            raise ValueError("unknown phase {}".format(name))
+        if not self.enabled:
+            yield
+            return
+        frame = [name, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+            timing = self.classes.setdefault(self._current, {}).setdefault(name, [0.0, 0])
+            timing[0] += elapsed - frame[2]
+            timing[1] += 1
+
+    @contextmanager
+    def klass(self, class_name, profile=True):
+        """
+        attributes phases of the enclosed block to class_name, profiling it if
+        requested and profile is true; blocks entered for a class after its
+        main one (such as writing its module) pass profile=False, so that its
+        cProfile stats are not replaced
+        """
+        if not self.enabled:
+            yield
+            return
+        previous = self._current
+        self._current = class_name
+        profile = cProfile.Profile() if self.profile_dir and profile else None
+        try:
+            if profile is not None:
+                profile.enable()
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.profile_dir, class_name + '.prof'))
+            self._current = previous
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def take(self, class_name):
+        """removes and returns the timings of a class, e.g. to send them from a worker process"""
+        return self.classes.pop(class_name, {})
+
+    def merge(self, class_name, timings):
+        """adds timings returned by take() in another process"""
+        for name, (seconds, calls) in timings.items():
+            timing = self.classes.setdefault(class_name, {}).setdefault(name, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += calls
+
+    def class_totals(self):
+        """returns {class name: total seconds}, for classes only (not the run itself)"""
+        return {klass: sum(seconds for seconds, _ in timings.values())
+                for klass, timings in self.classes.items() if klass is not None}
+
+    def report(self):
+        """
+        Returns
+        -------
+        dict
+            'phases': {phase: {'seconds', 'calls'}} over the whole run
+            'classes': {class: {'total': seconds, 'phases': {phase: {'seconds', 'calls'}}}}
+            'counters': {name: value}
+        """
+        phases = {}
+        for timings in self.classes.values():
+            for name, (seconds, calls) in timings.items():
+                total = phases.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                total['seconds'] += seconds
+                total['calls'] += calls
+        totals = self.class_totals()
+        classes = {klass: {'total': totals[klass],
+                           'phases': {name: {'seconds': seconds, 'calls': calls}
+                                      for name, (seconds, calls) in timings.items()}}
+                   for klass, timings in self.classes.items() if klass is not None}
+        return {'phases': phases, 'classes': classes, 'counters': dict(self.counters)}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def prometheus(self):
+        """returns the report in the Prometheus text exposition format"""
+        report = self.report()
+        lines = ['# HELP autogen_phase_seconds_total Time spent in each generation phase.',
+                 '# TYPE autogen_phase_seconds_total counter']
+        for name, total in sorted(report['phases'].items()):
+            lines.append('autogen_phase_seconds_total{{phase="{}"}} {}'.format(name, total['seconds']))
+        lines += ['# HELP autogen_phase_calls_total Number of times each generation phase ran.',
+                  '# TYPE autogen_phase_calls_total counter']
+        for name, total in sorted(report['phases'].items()):
+            lines.append('autogen_phase_calls_total{{phase="{}"}} {}'.format(name, total['calls']))
+        lines += ['# HELP autogen_class_phase_seconds Time spent in each phase per generated class.',
+                  '# TYPE autogen_class_phase_seconds gauge']
+        for klass, entry in sorted(report['classes'].items()):
+            for name, total in sorted(entry['phases'].items()):
+                lines.append('autogen_class_phase_seconds{{class="{}",phase="{}"}} {}'.format(
+                    klass, name, total['seconds']))
+        lines += ['# HELP autogen_events_total Generation events by kind.',
+                  '# TYPE autogen_events_total counter']
+        for name, value in sorted(report['counters'].items()):
+            lines.append('autogen_events_total{{event="{}"}} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def keep_slowest_profiles(self, top):
+        """deletes the cProfile stats of all but the top slowest classes; returns their paths, slowest first"""
+        slowest = sorted(self.class_totals().items(), key=lambda item: -item[1])
+        kept = []
+        for i, (klass, _) in enumerate(slowest):
+            path = os.path.join(self.profile_dir, klass + '.prof')
+            if not os.path.exists(path):
+                continue
+            if i < top:
+                kept.append(path)
+            else:
+                os.remove(path)
+        return kept
+
+
+# profiler of this process
+profiler = Profiler()
+
+
+def enable(profile_dir=None):
+    """starts recording into a fresh module level profiler and returns it"""
+    global profiler
+    profiler = Profiler(True, profile_dir)
+    return profiler
+
+
+def phase(name):
+    return profiler.phase(name)
+
+
+def klass(class_name, profile=True):
+    return profiler.klass(class_name, profile)
+
+
+def count(name, n=1):
+    profiler.count(name, n)
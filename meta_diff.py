@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Difference between two versions of the ACI meta
+
+Compares two aci-meta.json files (or indexed / sharded meta stores) class by
+class: class fields, properties, property options and containment. The
+classes whose record changed are then looked up in a reverse index built
+from the build manifest, which lists for every generated module its class
+and the classes of its DN; every module depending on a changed class is
+affected. So are modules of classes below a class whose containers changed
+(found through the containment graph of the new meta), as their set of
+possible DNs may differ.
+
+With --generate exactly the affected modules are regenerated against the
+new meta through ansible_model, into the directory of the manifest. Their DNs
+are taken from the DN lock file of that directory (see dn_policy.py), so that
+they keep the DNs they were generated with; --dn-strategy only applies to
+classes missing from it, such as added classes.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from build_manifest import BuildManifest, MANIFEST_NAME
+from containment_graph import ContainmentGraph
+from dn_policy import DNPolicy, DEFAULT_STRATEGY, LOCK_NAME
+from meta_store import load_classes
+from object_model import DN_LIMIT
+from output_sink import DirectorySink
+
+# keys of a class record compared on their own; dnFormat is derived by MIM
+_CONTAINMENT = ('contains', 'containers')
+_SKIPPED = ('properties', 'dnFormat') + _CONTAINMENT
+
+
+def _added_removed(old, new):
+    return sorted(set(new) - set(old)), sorted(set(old) - set(new))
+
+
+def diff_class(old, new):
+    """
+    Parameters
+    ----------
+    old : dict
+        record of the class in the old meta
+    new : dict
+        record of the class in the new meta
+    Returns
+    -------
+    dict
+        changes by kind, empty if the records are the same:
+        'fields': class fields that differ
+        'properties': {'added', 'removed', 'changed'} property names
+        'options': {property: {'added', 'removed'}} options of common properties
+        'containment': {'contains'|'containers': {'added', 'removed'}}
+    """
+    changes = {}
+    fields = sorted(key for key in set(old) | set(new)
+                    if key not in _SKIPPED and old.get(key) != new.get(key))
+    if fields:
+        changes['fields'] = fields
+
+    old_props, new_props = old.get('properties', {}), new.get('properties', {})
+    added, removed = _added_removed(old_props, new_props)
+    changed = []
+    options = {}
+    for prop in sorted(set(old_props) & set(new_props)):
+        before, after = old_props[prop], new_props[prop]
+        if {k: v for k, v in before.items() if k != 'options'} != {k: v for k, v in after.items() if k != 'options'}:
+            changed.append(prop)
+        if before.get('options', []) != after.get('options', []):
+            opt_added, opt_removed = _added_removed(before.get('options', []), after.get('options', []))
+            options[prop] = {'added': opt_added, 'removed': opt_removed}
+    if added or removed or changed:
+        changes['properties'] = {'added': added, 'removed': removed, 'changed': changed}
+    if options:
+        changes['options'] = options
+
+    containment = {}
+    for key in _CONTAINMENT:
+        added, removed = _added_removed(old.get(key, {}), new.get(key, {}))
+        if added or removed:
+            containment[key] = {'added': added, 'removed': removed}
+    if containment:
+        changes['containment'] = containment
+    return changes
+
+
+def diff_meta(old, new):
+    """
+    Parameters
+    ----------
+    old : Mapping
+        classes of the old meta
+    new : Mapping
+        classes of the new meta
+    Returns
+    -------
+    dict
+        'added' and 'removed' class names, 'changed' class name mapped to
+        the changes returned by diff_class
+    """
+    added, removed = _added_removed(old, new)
+    changed = {}
+    for class_name in sorted(set(old) & set(new)):
+        changes = diff_class(old[class_name], new[class_name])
+        if changes:
+            changed[class_name] = changes
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+
+def reverse_index(manifest):
+    """returns {class: set of generated files whose class or DN includes it} from a BuildManifest"""
+    index = {}
+    for out, entry in manifest.outputs.items():
+        for klass in [entry['class']] + entry.get('classes', []):
+            index.setdefault(klass, set()).add(out)
+    return index
+
+
+def affected_modules(diff, manifest, graph):
+    """
+    Parameters
+    ----------
+    diff : dict
+        as returned by diff_meta
+    manifest : BuildManifest
+        manifest of the generated modules
+    graph : ContainmentGraph
+        containment graph of the new meta
+    Returns
+    -------
+    dict
+        generated file mapped to its class, for every module depending on a
+        changed or removed class, or below a class whose containers changed
+    """
+    index = reverse_index(manifest)
+    touched = set(diff['changed']) | set(diff['removed'])
+    moved = [klass for klass, changes in diff['changed'].items()
+             if 'containers' in changes.get('containment', {})]
+    for klass in moved:
+        touched |= graph.descendants(klass)
+    outputs = set()
+    for klass in touched:
+        outputs |= index.get(klass, set())
+    return {out: manifest.outputs[out]['class'] for out in sorted(outputs)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff two versions of the ACI meta and find the affected modules')
+    parser.add_argument('old', help='old aci meta json file or meta store')
+    parser.add_argument('new', help='new aci meta json file or meta store')
+    parser.add_argument('--manifest', default=MANIFEST_NAME, help='build manifest of the generated modules')
+    parser.add_argument('-r', '--report', help='write the diff and affected modules as json to this path')
+    parser.add_argument('--include-added', action='store_true', help='also generate modules for added classes')
+    parser.add_argument('-g', '--generate', action='store_true',
+                        help='regenerate the affected modules against the new meta')
+    parser.add_argument('--dn-strategy', default=DEFAULT_STRATEGY,
+                        help='DN strategy used with --generate for the classes missing from the DN lock file')
+    parser.add_argument('--dn-lock', help='DN lock file used with --generate, by default {} next to the manifest; '
+                        'required to exist'.format(LOCK_NAME))
+    parser.add_argument('--dn-limit', type=int, default=DN_LIMIT,
+                        help='maximum number of DN formats listed for a class with --generate (0 for all)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes rendering modules')
+    parser.add_argument('--cache-graph', action='store_true',
+                        help='reuse or save the containment graph of the new meta next to it')
+    args = parser.parse_args()
+    if args.dn_limit < 0:
+        parser.error("--dn-limit must not be negative")
+    # the modules are regenerated next to the manifest, keeping the DNs they were generated with
+    directory = os.path.dirname(os.path.abspath(args.manifest))
+    dn_lock = args.dn_lock or os.path.join(directory, LOCK_NAME)
+    if args.generate and not os.path.exists(dn_lock):
+        parser.error("--generate needs the DN lock file of the modules, {} does not exist".format(dn_lock))
+
+    old, new = load_classes(args.old), load_classes(args.new)
+    diff = diff_meta(old, new)
+    manifest = BuildManifest(args.manifest)
+    graph = ContainmentGraph.cached(args.new, new) if args.cache_graph else ContainmentGraph.from_meta(new)
+    affected = affected_modules(diff, manifest, graph)
+    classes = sorted(set(klass for klass in affected.values() if klass in new))
+    if args.include_added:
+        classes += diff['added']
+
+    print("{} classes added, {} removed, {} changed".format(
+        len(diff['added']), len(diff['removed']), len(diff['changed'])))
+    print("{} of {} modules affected".format(len(affected), len(manifest.outputs)))
+    for out, klass in affected.items():
+        print("{} ({}{})".format(out, klass, ', removed' if klass not in new else ''))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'diff': diff, 'affected': affected, 'classes': classes}, f, indent=2, sort_keys=True)
+
+    if args.generate and classes:
+        import ansible_generator # only when generating, as it opens module.log on import
+        policy = DNPolicy(default=args.dn_strategy, lock_path=dn_lock)
+        errors = {}
+        with DirectorySink(directory) as sink:
+            ansible_generator.ansible_model(classes, new, jobs=args.jobs, errors=errors, manifest=manifest,
+                                            policy=policy, sink=sink, dn_limit=args.dn_limit or None)
+        manifest.save()
+        policy.save()
+        print("{} modules rebuilt, {} unchanged".format(len(manifest.rebuilt), len(manifest.unchanged)))
+        for klass, error in errors.items():
+            print("Failed to create module for {}: {}".format(klass, error), file=sys.stderr)
+        if errors:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
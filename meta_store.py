@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Indexed on-disk store for the ACI meta
+
+aci-meta.json is converted once into a single file holding an offset table
+followed by one JSON record per class. The file is memory-mapped and a class
+record is only decoded the first time it is requested, so loading the store
+costs the size of the offset table rather than the size of the whole model.
+
+Layout:
+    MAGIC (8 bytes) | table length (8 bytes, big endian) | table | records
+where table is a JSON object mapping class names to [offset, length] pairs,
+offsets being relative to the start of the records section.
+
+metagen.py --shard writes the same kind of records split by package, one
+<package>.json per package, with an index.json mapping class names to
+[shard, offset, length]; ShardedMetaStore reads that layout.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+MAGIC = b'ACIMETA1'
+_HEADER = struct.Struct('>8sQ')
+
+# index of the output of metagen.py --shard, see ShardedMetaStore
+SHARD_INDEX = 'index.json'
+SHARD_FORMAT = 'aci-meta-shards/1'
+
+# indexed copies of plain meta files made by indexed_copy
+META_CACHE_DIR = os.environ.get('AUTOGEN_META_CACHE',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'ansible-autogen', 'meta'))
+
+
+class MetaStore(MutableMapping):
+    """
+    Read-only view of an indexed meta file behaving like the 'classes' dict
+    of aci-meta.json
+
+    Decoded class records are kept, so changes made to them (e.g. the
+    dnFormat added by MIM._add_dn) persist for the life of the store, unless
+    cache_size bounds the number of decoded records kept; the least recently
+    used ones are then dropped and decoded again when requested.
+    Assigned or deleted entries are kept in memory only.
+    """
+
+    def __init__(self, path, cache_size=None):
+        """
+        Parameters
+        ----------
+        path : str
+            path of a file created by MetaStore.convert
+        cache_size : int
+            maximum number of decoded records kept; unbounded if not provided
+        """
+        self.path = path
+        self.cache_size = cache_size
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, table_len = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{} is not an indexed meta file".format(path))
+        table_start = _HEADER.size
+        self._base = table_start + table_len
+        self._table = json.loads(self._map[table_start:self._base].decode('utf-8'))
+        self._cache = OrderedDict() # decoded records, least recently used first
+        self._assigned = {}
+        self._deleted = set()
+
+    def __getitem__(self, class_name):
+        if class_name in self._assigned:
+            return self._assigned[class_name]
+        if class_name in self._cache:
+            self._cache.move_to_end(class_name)
+            return self._cache[class_name]
+        if class_name in self._deleted or class_name not in self._table:
+            raise KeyError(class_name)
+        record = json.loads(self._read(class_name).decode('utf-8'))
+        self._cache[class_name] = record
+        if self.cache_size is not None and len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return record
+
+    def _read(self, class_name):
+        """returns the encoded record of a class found in the table"""
+        offset, length = self._table[class_name]
+        start = self._base + offset
+        return self._map[start:start + length]
+
+    def __setitem__(self, class_name, record):
+        self._deleted.discard(class_name)
+        self._cache.pop(class_name, None)
+        self._assigned[class_name] = record
+
+    def __delitem__(self, class_name):
+        if class_name not in self:
+            raise KeyError(class_name)
+        self._cache.pop(class_name, None)
+        self._assigned.pop(class_name, None)
+        self._deleted.add(class_name)
+
+    def __contains__(self, class_name):
+        if class_name in self._deleted:
+            return False
+        return class_name in self._assigned or class_name in self._table
+
+    def __iter__(self):
+        for class_name in self._table:
+            if class_name not in self._deleted:
+                yield class_name
+        for class_name in self._assigned:
+            if class_name not in self._table:
+                yield class_name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        # reopen by path instead of pickling the mapping (e.g. for worker processes)
+        return (MetaStore, (self.path, self.cache_size))
+
+    def close(self):
+        """releases the memory map and the underlying file"""
+        self._map.close()
+        self._file.close()
+
+    @staticmethod
+    def is_store(path):
+        """returns True if path is an indexed meta file"""
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+
+    @staticmethod
+    def convert(json_path, store_path):
+        """
+        Converts an aci-meta.json file into an indexed meta file
+
+        Parameters
+        ----------
+        json_path : str
+            path of the aci meta json file
+        store_path : str
+            path of the indexed meta file to write
+        Returns
+        -------
+        int
+            number of classes written
+        """
+        with open(json_path, 'r') as f:
+            classes = json.load(f)['classes']
+
+        table = {}
+        records = []
+        offset = 0
+        for class_name in sorted(classes):
+            record = json.dumps(classes[class_name], sort_keys=True,
+                                separators=(',', ':')).encode('utf-8')
+            table[class_name] = [offset, len(record)]
+            records.append(record)
+            offset += len(record)
+        table_bytes = json.dumps(table, separators=(',', ':')).encode('utf-8')
+
+        with open(store_path, 'wb') as out:
+            out.write(_HEADER.pack(MAGIC, len(table_bytes)))
+            out.write(table_bytes)
+            for record in records:
+                out.write(record)
+        return len(records)
+
+
+class ShardedMetaStore(MetaStore):
+    """
+    MetaStore over the per-package output of metagen.py --shard
+
+    Only index.json is read up front; a shard is memory-mapped the first
+    time one of its classes is requested, so generating a few classes only
+    touches the packages of those classes and of their DN ancestors.
+    """
+
+    def __init__(self, path, cache_size=None):
+        """
+        Parameters
+        ----------
+        path : str
+            shard directory or the path of its index.json
+        cache_size : int
+            maximum number of decoded records kept; unbounded if not provided
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, SHARD_INDEX)
+        self.path = path
+        self.cache_size = cache_size
+        self._dir = os.path.dirname(path)
+        with open(path, 'r') as f:
+            index = json.load(f)
+        if index.get('format') != SHARD_FORMAT:
+            raise ValueError("{} is not a meta shard index".format(path))
+        self._table = index['classes']
+        self._shards = {} # shard name -> (file, memory map)
+        self._cache = OrderedDict()
+        self._assigned = {}
+        self._deleted = set()
+
+    def _read(self, class_name):
+        shard, offset, length = self._table[class_name]
+        if shard not in self._shards:
+            f = open(os.path.join(self._dir, shard), 'rb')
+            self._shards[shard] = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._shards[shard][1][offset:offset + length]
+
+    def __reduce__(self):
+        return (ShardedMetaStore, (self.path, self.cache_size))
+
+    @property
+    def open_shards(self):
+        """names of the shards mapped so far"""
+        return sorted(self._shards)
+
+    def close(self):
+        for f, shard_map in self._shards.values():
+            shard_map.close()
+            f.close()
+        self._shards.clear()
+
+    @staticmethod
+    def is_store(path):
+        """returns True if path is a shard directory or its index.json"""
+        if os.path.isdir(path):
+            path = os.path.join(path, SHARD_INDEX)
+        if os.path.basename(path) != SHARD_INDEX or not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as f:
+            return SHARD_FORMAT.encode('utf-8') in f.read(256)
+
+
+def open_store(path, cache_size=None):
+    """
+    Returns
+    -------
+    MetaStore
+        store for an indexed meta file or a shard directory, None if path is
+        neither (e.g. a plain aci-meta.json)
+    """
+    if ShardedMetaStore.is_store(path):
+        return ShardedMetaStore(path, cache_size)
+    if os.path.isfile(path) and MetaStore.is_store(path):
+        return MetaStore(path, cache_size)
+    return None
+
+
+def indexed_copy(json_path, cache_dir=META_CACHE_DIR):
+    """
+    Returns the path of an indexed meta file converted from json_path, kept
+    in cache_dir and converted again when json_path changes
+
+    The conversion decodes the whole model, so it runs in a child process
+    whose memory is released once it is done.
+    """
+    json_path = os.path.abspath(json_path)
+    info = os.stat(json_path)
+    prefix = hashlib.sha256(json_path.encode('utf-8')).hexdigest()[:16]
+    stamp = hashlib.sha256('{}:{}'.format(info.st_size, info.st_mtime_ns).encode('utf-8')).hexdigest()[:16]
+    store_path = os.path.join(cache_dir, '{}-{}.meta'.format(prefix, stamp))
+    if os.path.exists(store_path):
+        return store_path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = '{}.{}.tmp'.format(store_path, os.getpid())
+    process = multiprocessing.Process(target=MetaStore.convert, args=(json_path, tmp))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise ValueError("could not convert {} into an indexed meta file".format(json_path))
+    os.replace(tmp, store_path)
+    for name in os.listdir(cache_dir): # copies of earlier versions of the file
+        if name.startswith(prefix + '-') and name.endswith('.meta') and name != os.path.basename(store_path):
+            os.remove(os.path.join(cache_dir, name))
+    return store_path
+
+
+def load_classes(path):
+    """returns the classes of an aci meta json file, indexed meta file or shard directory as a mapping"""
+    store = open_store(path)
+    if store is not None:
+        return store
+    with open(path, 'r') as f:
+        return json.load(f)['classes']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert aci-meta.json into an indexed meta file')
+    parser.add_argument('meta', help='path to aci meta json file')
+    parser.add_argument('output', help='path of the indexed meta file to create')
+    args = parser.parse_args()
+
+    count = MetaStore.convert(args.meta, args.output)
+    print("Indexed {} classes into {}".format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
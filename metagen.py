@@ -1,12 +1,26 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
-from insieme.pymit.pyaccess import PyClassDirectory
+import argparse
+import gzip
 import json
 import multiprocessing
+import os
 import re
 
-dir = PyClassDirectory()
+try:
+    from insieme.pymit.pyaccess import PyClassDirectory
+except ImportError: # not on an APIC; main() then needs a stand-in directory
+    PyClassDirectory = None
+
+# class directory used by generateClassMeta, set by main() before the pool is forked
+dir = None
+
+# classes handed to a worker at a time
+CHUNK_SIZE = 64
+
+# format tag of the index.json of sharded output, read by meta_store.ShardedMetaStore
+SHARD_FORMAT = 'aci-meta-shards/1'
 
 
 def getPaciClassName(classMeta):
@@ -45,7 +59,7 @@ def generateClassMeta(className):
             'help': p._getHelp(),
             # 'options': p.getType().getLabelConstMap()
             # use p.getType().getConstants() for both str label and internal value
-            'options': p.getType()._constMap.keys() if p.isConfig() else []
+            'options': list(p.getType()._constMap.keys()) if p.isConfig() else []
         }
         for p in classMeta.getProperties()
     }
@@ -80,18 +94,133 @@ def generateClassMeta(className):
     return (paciClassName, paciClassMeta)
 
 
-def main():
-    classNames = dir.getClassNames()
-
-    aciMeta = {}
-
-    pool = multiprocessing.Pool(multiprocessing.cpu_count())
-    aciClassMetas = pool.imap(generateClassMeta, classNames)
-    aciMeta['classes'] = dict(aciClassMetas)
-
-    with open('aci-meta.json', 'w') as out:
-        json.dump(aciMeta, out,
-                  sort_keys=True, indent=2, separators=(',', ': '))
+def _encode(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+
+def writeMeta(out, classMetas, compact=False):
+    """
+    Writes (name, meta) pairs to the binary file out as aci-meta.json, one
+    class at a time, with sorted keys within each class; the output is the
+    same as json.dump of the whole meta with sorted keys, given names in order
+    compact drops the indentation and spaces of the default layout
+    """
+    if compact:
+        out.write(b'{"classes":{')
+        dumpArgs = {'sort_keys': True, 'separators': (',', ':')}
+        separator, newline = b',', b''
+    else:
+        out.write(b'{\n  "classes": {')
+        dumpArgs = {'sort_keys': True, 'indent': 2, 'separators': (',', ': ')}
+        separator, newline = b',', b'\n    '
+    count = 0
+    for name, classMeta in classMetas:
+        if count:
+            out.write(separator)
+        out.write(newline)
+        text = json.dumps(classMeta, **dumpArgs)
+        if not compact:
+            text = text.replace('\n', '\n    ')
+        out.write(_encode(json.dumps(name) + (':' if compact else ': ') + text))
+        count += 1
+    if compact:
+        out.write(b'}}')
+    else:
+        out.write(b'\n  }\n}' if count else b'}\n}')
+    return count
+
+
+def getPackage(className):
+    """package prefix of a class name, e.g. fv for fvTenant"""
+    return re.match(r'[a-z0-9]*', className).group()
+
+
+def writeShards(directory, classMetas):
+    """
+    Writes (name, meta) pairs, grouped by package, as one shard per package
+    (<package>.json, one compact class record per line) plus index.json
+    mapping each class name to [shard, offset, length] within its shard
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    index = {}
+    shard = None
+    out = None
+    offset = 0
+    try:
+        for name, classMeta in classMetas:
+            package = getPackage(name)
+            if package != shard:
+                if out is not None:
+                    out.close()
+                shard = package
+                out = open(os.path.join(directory, shard + '.json'), 'wb')
+                offset = 0
+            data = _encode(json.dumps(classMeta, sort_keys=True, separators=(',', ':')))
+            index[name] = [shard + '.json', offset, len(data)]
+            out.write(data + b'\n')
+            offset += len(data) + 1
+    finally:
+        if out is not None:
+            out.close()
+    with open(os.path.join(directory, 'index.json'), 'wb') as f:
+        # format first, so that readers can recognise the index from its first bytes
+        f.write(_encode('{"format":' + json.dumps(SHARD_FORMAT) + ',"classes":'))
+        f.write(_encode(json.dumps(index, sort_keys=True, separators=(',', ':'))))
+        f.write(b'}\n')
+    return len(index)
+
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description='Generate aci-meta.json from the APIC class directory')
+    parser.add_argument('-o', '--output', help='output file (default aci-meta.json, or aci-meta.json.gz with --gzip)')
+    parser.add_argument('-c', '--compact', action='store_true', help='write without indentation')
+    parser.add_argument('-z', '--gzip', action='store_true', help='gzip the output')
+    parser.add_argument('-s', '--shard', metavar='DIR',
+                        help='write one shard per package and an index.json into DIR instead')
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+    if args.shard and (args.output or args.compact or args.gzip):
+        parser.error('--shard cannot be combined with --output, --compact or --gzip')
+    return args
+
+
+def main(argv=None, directory=None):
+    """
+    directory stands in for PyClassDirectory(), e.g. when not running on an APIC
+    """
+    global dir
+    args = parseArgs(argv)
+    if directory is None:
+        if PyClassDirectory is None:
+            raise SystemExit('insieme.pymit is not available; metagen.py must run on an APIC')
+        directory = PyClassDirectory()
+    dir = directory
+
+    # sorted names and an ordered imap keep the output deterministic
+    classNames = sorted(dir.getClassNames())
+
+    pool = multiprocessing.Pool(args.processes)
+    if args.shard:
+        output = args.shard
+        out = None
+        classNames.sort(key=lambda name: (getPackage(name), name)) # each shard written in one go
+    else:
+        output = args.output or ('aci-meta.json.gz' if args.gzip else 'aci-meta.json')
+        out = gzip.open(output, 'wb') if args.gzip else open(output, 'wb')
+    try:
+        aciClassMetas = pool.imap(generateClassMeta, classNames, CHUNK_SIZE)
+        if out is None:
+            count = writeShards(output, aciClassMetas)
+        else:
+            count = writeMeta(out, aciClassMetas, args.compact)
+    finally:
+        pool.close()
+        pool.join()
+        if out is not None:
+            out.close()
+    print('Wrote {} classes to {}'.format(count, output))
 
 if __name__ == '__main__':
     main()
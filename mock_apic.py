@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Mock APIC for trying generated modules locally
+
+Serves the parts of the APIC REST API used by the generated modules over
+plain HTTP (run the modules with use_ssl: no), keeping managed objects in
+memory by DN:
+
+    POST   /api/aaaLogin.json             any credentials are accepted
+    GET    /api/mo/<dn>.json              the object; query-target=children or
+                                          subtree, target-subtree-class,
+                                          rsp-subtree=full and rsp-subtree-class
+    GET    /api/class/<class>.json        objects of a class
+    POST   /api/mo/<dn>.json              object tree; status deleted removes
+    DELETE /api/mo/<dn>.json              object and its subtree
+    GET    /mock/stats                    request counts by method, object count
+    POST   /mock/reset                    removes every object, resets counts
+
+Queries also take query-target-filter (eq, ne, lt, gt, le, ge, wcard, and,
+or, not), rsp-prop-include (config-only and naming-only need --meta),
+rsp-subtree-include=count, order-by and page / page-size, returning the
+total number of matching objects in totalCount like the APIC.
+
+Posted children are placed by their dn attribute, their rn attribute, or,
+given --meta, the rnFormat of their class. --fill CLASS=COUNT creates COUNT
+objects of CLASS to try queries of large classes.
+"""
+
+import argparse
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from meta_store import load_classes
+
+_token = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|([\w.-]+)|([(),]))')
+_compare = {
+    'eq': lambda a, b: a == b,
+    'ne': lambda a, b: a != b,
+    'lt': lambda a, b: _number(a) < _number(b),
+    'gt': lambda a, b: _number(a) > _number(b),
+    'le': lambda a, b: _number(a) <= _number(b),
+    'ge': lambda a, b: _number(a) >= _number(b),
+    'wcard': lambda a, b: re.search(b, a) is not None,
+}
+
+
+class APIError(Exception):
+    def __init__(self, status, text):
+        Exception.__init__(self, text)
+        self.status = status
+
+
+def parent_dn(dn):
+    """returns the DN of the parent of dn, ignoring slashes inside [] of an rn"""
+    depth = 0
+    for i in range(len(dn) - 1, -1, -1):
+        if dn[i] == ']':
+            depth += 1
+        elif dn[i] == '[':
+            depth -= 1
+        elif dn[i] == '/' and depth == 0:
+            return dn[:i]
+    return ''
+
+
+def _number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_filter(expression):
+    """
+    Parameters
+    ----------
+    expression : str
+        query-target-filter, e.g. and(eq(fvBD.name,"bd1"),ne(fvBD.descr,""))
+    Returns
+    -------
+    tuple
+        (function, arguments) where arguments are nested tuples or strings
+    """
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _token.match(expression, position)
+        if match is None:
+            raise APIError(400, "invalid filter {}".format(expression))
+        quoted, word, punctuation = match.groups()
+        tokens.append(('str', quoted.replace('\\"', '"')) if quoted is not None else (word or punctuation, None))
+        position = match.end()
+
+    def parse(i):
+        name, value = tokens[i]
+        if value is not None or i + 1 >= len(tokens) or tokens[i + 1][0] != '(':
+            return value if value is not None else name, i + 1
+        arguments = []
+        i += 2
+        while tokens[i][0] != ')':
+            argument, i = parse(i)
+            arguments.append(argument)
+            if tokens[i][0] == ',':
+                i += 1
+        return (name, arguments), i + 1
+
+    try:
+        tree, end = parse(0)
+    except IndexError:
+        raise APIError(400, "invalid filter {}".format(expression))
+    if end != len(tokens) or not isinstance(tree, tuple):
+        raise APIError(400, "invalid filter {}".format(expression))
+    return tree
+
+
+def match_filter(tree, aci_class, attributes):
+    """returns True if an object matches a filter parsed by parse_filter, None matching everything"""
+    if tree is None:
+        return True
+    name, arguments = tree
+    if name == 'and':
+        return all(match_filter(argument, aci_class, attributes) for argument in arguments)
+    if name == 'or':
+        return any(match_filter(argument, aci_class, attributes) for argument in arguments)
+    if name == 'not':
+        return not match_filter(arguments[0], aci_class, attributes)
+    if name not in _compare or len(arguments) != 2:
+        raise APIError(400, "unsupported filter function {}".format(name))
+    klass, _, prop = arguments[0].partition('.')
+    if klass != aci_class:
+        return True
+    value = attributes.get(prop)
+    return value is not None and _compare[name](value, arguments[1])
+
+
+class ObjectStore:
+    """
+    Instance holds the managed objects of the mock, by DN
+    """
+
+    def __init__(self, classes=None):
+        """
+        Parameters
+        ----------
+        classes : Mapping
+            classes of the meta, used to build the rn of posted children
+            that have neither dn nor rn attributes, and for rsp-prop-include
+        """
+        self.classes = classes
+        self.objects = {} # dn -> (class, attributes)
+        self.by_class = {} # class -> set of dns
+        self.lock = threading.RLock()
+
+    def _record(self, aci_class):
+        return self.classes.get(aci_class) if self.classes is not None else None
+
+    def rn(self, aci_class, attributes):
+        if 'rn' in attributes:
+            return attributes['rn']
+        record = self._record(aci_class)
+        if record is None:
+            raise APIError(400, "cannot place {} without a dn or rn attribute".format(aci_class))
+        try:
+            return record['rnFormat'].format(**attributes)
+        except KeyError as e:
+            raise APIError(400, "naming property {} of {} missing".format(e, aci_class))
+
+    def post(self, node, dn=None):
+        """applies a posted object tree, node being {class: {'attributes', 'children'}}"""
+        with self.lock:
+            self._apply(node, dn, None)
+
+    def _apply(self, node, dn, parent):
+        (aci_class, body), = node.items()
+        attributes = dict(body.get('attributes', {}))
+        dn = attributes.get('dn') or dn or '{}/{}'.format(parent, self.rn(aci_class, attributes))
+        status = attributes.pop('status', None)
+        if status == 'deleted':
+            self.delete(dn)
+            return
+        attributes['dn'] = dn
+        if dn in self.objects:
+            self.objects[dn][1].update(attributes)
+        else:
+            self.objects[dn] = (aci_class, attributes)
+            self.by_class.setdefault(aci_class, set()).add(dn)
+        for child in body.get('children', []):
+            self._apply(child, None, dn)
+
+    def fill(self, aci_class, count, parent='uni'):
+        """
+        creates count objects of aci_class under parent, their properties
+        cycling through the options of the property in the meta
+        """
+        record = self._record(aci_class) or {}
+        properties = {prop: details for prop, details in record.get('properties', {}).items() if prop != 'status'}
+        with self.lock:
+            for i in range(count):
+                attributes = {}
+                for prop, details in properties.items():
+                    options = details.get('options')
+                    attributes[prop] = options[i % len(options)] if options else '{}-{}'.format(prop, i)
+                attributes['dn'] = '{}/{}-{}'.format(parent, aci_class, i)
+                self._apply({aci_class: {'attributes': attributes}}, None, None)
+
+    def delete(self, dn):
+        with self.lock:
+            for key in [key for key in self.objects if key == dn or key.startswith(dn + '/')]:
+                self.by_class[self.objects.pop(key)[0]].discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.objects.clear()
+            self.by_class.clear()
+
+    def _properties(self, aci_class, attributes, include):
+        if include in (None, 'all'):
+            return dict(attributes)
+        record = self._record(aci_class)
+        if record is None:
+            raise APIError(400, "rsp-prop-include={} needs the meta of {}".format(include, aci_class))
+        if include == 'naming-only':
+            keep = set(re.findall(r'{(\w+)}', record['rnFormat']))
+        elif include == 'config-only':
+            keep = {prop for prop, details in record.get('properties', {}).items() if details.get('isConfigurable')}
+        else:
+            raise APIError(400, "unsupported rsp-prop-include {}".format(include))
+        return {key: value for key, value in attributes.items() if key in keep or key == 'dn'}
+
+    def node(self, dn, params, subtree_classes=None, subtree=False):
+        aci_class, attributes = self.objects[dn]
+        body = {'attributes': self._properties(aci_class, attributes, params.get('rsp-prop-include'))}
+        if subtree:
+            children = [self.node(child, params, subtree_classes, True) for child in self.children(dn)
+                        if not subtree_classes or self.objects[child][0] in subtree_classes]
+            if children:
+                body['children'] = children
+        return {aci_class: body}
+
+    def children(self, dn):
+        return sorted(key for key in self.objects if parent_dn(key) == dn)
+
+    def descendants(self, dn):
+        return sorted(key for key in self.objects if key.startswith(dn + '/'))
+
+    def _respond(self, dns, params):
+        """
+        Returns
+        -------
+        (list, int)
+            the page of objects (or count) of dns matching the filter of
+            params, and the number of matching objects
+        """
+        tree = parse_filter(params['query-target-filter']) if params.get('query-target-filter') else None
+        dns = [key for key in dns if match_filter(tree, *self.objects[key])]
+        if params.get('rsp-subtree-include') == 'count':
+            return [{'moCount': {'attributes': {'count': str(len(dns))}}}], 1
+        order = params.get('order-by')
+        if order:
+            prop, _, direction = order.partition('|')
+            prop = prop.partition('.')[2]
+            dns.sort(key=lambda key: self.objects[key][1].get(prop, ''), reverse=direction == 'desc')
+        total = len(dns)
+        if 'page-size' in params:
+            size = int(params['page-size'])
+            page = int(params.get('page', 0))
+            dns = dns[page * size:(page + 1) * size]
+        subtree_classes = params['rsp-subtree-class'].split(',') if params.get('rsp-subtree-class') else None
+        subtree = params.get('rsp-subtree') == 'full'
+        return [self.node(key, params, subtree_classes, subtree) for key in dns], total
+
+    def query_mo(self, dn, params):
+        with self.lock:
+            target = params.get('query-target', 'self')
+            if target == 'children':
+                dns = self.children(dn)
+            elif target == 'subtree':
+                dns = ([dn] if dn in self.objects else []) + self.descendants(dn)
+            else:
+                dns = [dn] if dn in self.objects else []
+            if params.get('target-subtree-class'):
+                classes = params['target-subtree-class'].split(',')
+                dns = [key for key in dns if self.objects[key][0] in classes]
+            return self._respond(dns, params)
+
+    def query_class(self, aci_class, params):
+        with self.lock:
+            return self._respond(sorted(self.by_class.get(aci_class, ())), params)
+
+
+class MockAPIC(ThreadingHTTPServer):
+    """
+    HTTP server answering APIC REST requests from an ObjectStore
+    """
+    daemon_threads = True
+
+    def __init__(self, address, store=None, verbose=False):
+        ThreadingHTTPServer.__init__(self, address, _Handler)
+        self.store = store or ObjectStore()
+        self.verbose = verbose
+        self.counts = {}
+        self.counts_lock = threading.Lock()
+
+    def count(self, method):
+        with self.counts_lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _imdata(self, objects, status=200, headers=None, total=None):
+        total = len(objects) if total is None else total
+        self._send(status, {'totalCount': str(total), 'imdata': objects}, headers)
+
+    def _error(self, status, text):
+        self._imdata([{'error': {'attributes': {'code': str(status), 'text': text}}}], status)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def _route(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = unquote(url.path)
+        for prefix in ('/api/mo/', '/api/class/'):
+            if path.startswith(prefix) and path.endswith('.json'):
+                return prefix, path[len(prefix):-len('.json')], params
+        return None, path, params
+
+    def _handle(self, method):
+        self.server.count(method)
+        kind, target, params = self._route()
+        store = self.server.store
+        try:
+            if method == 'GET' and target == '/mock/stats':
+                self._send(200, {'requests': dict(self.server.counts), 'objects': len(store.objects)})
+            elif method == 'POST' and target == '/mock/reset':
+                store.clear()
+                with self.server.counts_lock:
+                    self.server.counts.clear()
+                self._send(200, {})
+            elif method == 'POST' and target == '/api/aaaLogin.json':
+                self._body()
+                self._imdata([{'aaaLogin': {'attributes': {'token': 'mock'}}}],
+                             headers={'Set-Cookie': 'APIC-cookie=mock'})
+            elif kind == '/api/mo/' and method == 'GET':
+                objects, total = store.query_mo(target, params)
+                self._imdata(objects, total=total)
+            elif kind == '/api/class/' and method == 'GET':
+                objects, total = store.query_class(target, params)
+                self._imdata(objects, total=total)
+            elif kind == '/api/mo/' and method == 'POST':
+                store.post(self._body(), target)
+                self._imdata([])
+            elif kind == '/api/mo/' and method == 'DELETE':
+                store.delete(target)
+                self._imdata([])
+            else:
+                self._error(400, "unsupported request {} {}".format(method, self.path))
+        except APIError as e:
+            self._error(e.status, str(e))
+        except (ValueError, KeyError, AttributeError) as e:
+            self._error(400, "malformed request: {}".format(e))
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a mock APIC over HTTP')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('-m', '--meta', help='aci meta json file or meta store, to place children posted without dn and for rsp-prop-include')
+    parser.add_argument('--load', help='json file of object trees ({class: {attributes, children}}) to start with')
+    parser.add_argument('--fill', action='append', default=[], metavar='CLASS=COUNT',
+                        help='create COUNT objects of CLASS under uni (repeatable)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    store = ObjectStore(load_classes(args.meta) if args.meta else None)
+    if args.load:
+        with open(args.load, 'r') as f:
+            for node in json.load(f):
+                store.post(node)
+    for fill in args.fill:
+        aci_class, _, count = fill.partition('=')
+        store.fill(aci_class, int(count))
+    server = MockAPIC((args.host, args.port), store, args.verbose)
+    print("Mock APIC listening on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
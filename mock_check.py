@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Check of generated modules against mock_apic.py
+
+Serves a MockAPIC in a thread and runs generated modules against it the way
+Ansible runs a module (a separate interpreter given a file of arguments),
+checking the objects they return or leave behind and the requests they make:
+
+- the read-only module of fvEPg: all pages, a single page, max_results (with
+  its warning when objects are left out) and count_only over 25 objects
+- the read/write module of fvBD generated with --aggregate: aggregate
+  entries given by option or alias, posted in chunks, idempotence, absent,
+  and the rejection of aggregate_chunk below 1 and of an option given along
+  with its alias
+
+Ansible 2.6 has to be importable by the interpreter running the modules;
+--ansible adds its lib directory to PYTHONPATH. For thin modules the
+directory must also hold the aci_autogen module_utils.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from meta_store import load_classes
+from mock_apic import MockAPIC, ObjectStore
+
+QUERY_OBJECTS = 25
+
+
+def _tenant(children):
+    return {'fvTenant': {'attributes': {'dn': 'uni/tn-t1', 'name': 't1'}, 'children': children}}
+
+
+class ModuleRunner:
+    """runs modules against a MockAPIC serving on a free local port"""
+
+    def __init__(self, classes, python=sys.executable, ansible=None):
+        self.server = MockAPIC(('127.0.0.1', 0), ObjectStore(classes))
+        self.port = self.server.server_address[1]
+        self.python = python
+        self.env = dict(os.environ)
+        if ansible:
+            self.env['PYTHONPATH'] = os.pathsep.join(p for p in (ansible, self.env.get('PYTHONPATH')) if p)
+        self.tmp = tempfile.mkdtemp(prefix='mock-check-')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def reset(self, *trees):
+        """replaces the objects of the mock by trees and resets its request counts"""
+        self.server.store.clear()
+        for tree in trees:
+            self.server.store.post(tree)
+        with self.server.counts_lock:
+            self.server.counts.clear()
+
+    def requests(self, method):
+        """returns the number of method requests made since the last reset, logins excluded"""
+        with self.server.counts_lock:
+            count = self.server.counts.get(method, 0)
+        return count - 1 if method == 'POST' else count # aaaLogin
+
+    def objects(self, aci_class):
+        """returns {dn: attributes} of the objects of aci_class held by the mock"""
+        store = self.server.store
+        with store.lock:
+            return {dn: dict(store.objects[dn][1]) for dn in store.by_class.get(aci_class, ())}
+
+    def run(self, module, **params):
+        """runs module with params and returns its result"""
+        args = dict(host='127.0.0.1', port=self.port, use_ssl=False, username='admin', password='mock',
+                    _ansible_check_mode=False, _ansible_remote_tmp=self.tmp, _ansible_keep_remote_files=False)
+        args.update(params)
+        path = os.path.join(self.tmp, 'args.json')
+        with open(path, 'w') as f:
+            json.dump({'ANSIBLE_MODULE_ARGS': args}, f)
+        process = subprocess.run([self.python, module, path], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, env=self.env, universal_newlines=True)
+        try:
+            return json.loads(process.stdout)
+        except ValueError:
+            return {'failed': True, 'msg': 'module crashed: {}'.format(process.stderr.strip()[-400:])}
+
+
+def _names(result, aci_class):
+    return [obj[aci_class]['attributes']['name'] for obj in result.get('current') or []]
+
+
+def check_query(runner, module):
+    """returns (check, problem or None) of the paging checks of the read-only module of fvEPg"""
+    epgs = [{'fvEPg': {'attributes': {'rn': 'epg-e{:02}'.format(i), 'name': 'e{:02}'.format(i)}}}
+            for i in range(QUERY_OBJECTS)]
+    names = ['e{:02}'.format(i) for i in range(QUERY_OBJECTS)]
+    cases = [
+        ('all pages', dict(page_size=7), names, QUERY_OBJECTS, 4, False),
+        ('single page', dict(page_size=7, page=2), names[14:21], QUERY_OBJECTS, 1, False),
+        ('max_results', dict(page_size=7, max_results=10), names[:10], QUERY_OBJECTS, 2, True),
+        ('max_results below page_size', dict(max_results=3), names[:3], QUERY_OBJECTS, 1, True),
+        ('max_results above the objects', dict(max_results=QUERY_OBJECTS), names, QUERY_OBJECTS, 1, False),
+        ('count_only', dict(count_only=True), [], QUERY_OBJECTS, 1, False),
+        ('filtered count_only', dict(count_only=True, query_filter='wcard(fvEPg.name,"e1")'), [], 10, 1, False),
+    ]
+    results = []
+    for check, params, expected, total, gets, warned in cases:
+        runner.reset(_tenant(epgs))
+        result = runner.run(module, **params)
+        if result.get('failed'):
+            problem = result.get('msg')
+        elif _names(result, 'fvEPg') != expected:
+            problem = 'returned {}'.format(_names(result, 'fvEPg'))
+        elif result.get('total_count') != total:
+            problem = 'total_count is {}, expected {}'.format(result.get('total_count'), total)
+        elif runner.requests('GET') != gets:
+            problem = '{} GET requests, expected {}'.format(runner.requests('GET'), gets)
+        elif bool(result.get('warnings')) != warned:
+            problem = 'warnings {}'.format(result.get('warnings'))
+        else:
+            problem = None
+        results.append(('query ' + check, problem))
+
+    runner.reset(_tenant(epgs))
+    result = runner.run(module, max_results=0)
+    results.append(('query max_results 0 rejected',
+                    None if result.get('failed') and 'max_results' in result.get('msg', '') else 'accepted'))
+    return results
+
+
+def check_aggregate(runner, module):
+    """returns (check, problem or None) of the aggregate checks of the read/write module of fvBD"""
+    results = []
+
+    def expect(check, result, changes, objects, posts):
+        if result.get('failed'):
+            problem = result.get('msg')
+        elif dict((key, sorted(result.get(key, []))) for key in changes) != changes:
+            problem = 'returned {}'.format(dict((key, result.get(key)) for key in changes))
+        elif runner.objects('fvBD') != objects:
+            problem = 'left {}'.format(runner.objects('fvBD'))
+        elif runner.requests('POST') != posts:
+            problem = '{} POST requests, expected {}'.format(runner.requests('POST'), posts)
+        else:
+            problem = None
+        results.append(('aggregate ' + check, problem))
+
+    def bd(name, **attributes):
+        return dict(attributes, dn='uni/tn-t1/BD-' + name, name=name)
+
+    runner.reset(_tenant([]))
+    aggregate = [{'bridge_domain': 'a'}, {'name': 'b', 'descr': 'x'}, {'name': 'c'}]
+    result = runner.run(module, tenant='t1', aggregate=aggregate, aggregate_chunk=2)
+    created = ['uni/tn-t1/BD-a', 'uni/tn-t1/BD-b', 'uni/tn-t1/BD-c']
+    expect('create by option and alias in chunks', result, {'created': created, 'modified': []},
+           {'uni/tn-t1/BD-a': bd('a'), 'uni/tn-t1/BD-b': bd('b', descr='x'), 'uni/tn-t1/BD-c': bd('c')}, 2)
+
+    with runner.server.counts_lock:
+        runner.server.counts.clear()
+    result = runner.run(module, tenant='t1', aggregate=aggregate)
+    expect('unchanged', result, {'created': [], 'modified': []},
+           {'uni/tn-t1/BD-a': bd('a'), 'uni/tn-t1/BD-b': bd('b', descr='x'), 'uni/tn-t1/BD-c': bd('c')}, 0)
+    if result.get('changed'):
+        results[-1] = ('aggregate unchanged', 'reported changed')
+
+    runner.reset(_tenant([{'fvBD': {'attributes': bd('a', descr='x')}}]))
+    result = runner.run(module, tenant='t1', aggregate=[{'bridge_domain': 'a', 'descr': 'y'}])
+    expect('modify by alias', result, {'created': [], 'modified': ['uni/tn-t1/BD-a']},
+           {'uni/tn-t1/BD-a': bd('a', descr='y')}, 1)
+
+    runner.reset(_tenant([{'fvBD': {'attributes': bd('a')}}, {'fvBD': {'attributes': bd('b')}}]))
+    result = runner.run(module, tenant='t1', state='absent', aggregate=[{'bridge_domain': 'a'}, {'name': 'z'}])
+    expect('absent', result, {'deleted': ['uni/tn-t1/BD-a']}, {'uni/tn-t1/BD-b': bd('b')}, 1)
+
+    for check, params, option in (('aggregate_chunk 0 rejected', dict(aggregate_chunk=0), 'aggregate_chunk'),
+                                  ('option and alias rejected', {}, 'alias')):
+        runner.reset(_tenant([]))
+        result = runner.run(module, tenant='t1', aggregate=[{'name': 'a', 'bridge_domain': 'b'}]
+                            if option == 'alias' else [{'name': 'a'}], **params)
+        failed = result.get('failed') and option in result.get('msg', '')
+        results.append(('aggregate ' + check, None if failed and not runner.objects('fvBD') else
+                        'not rejected: {}'.format(result.get('msg'))))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check generated modules against a mock APIC')
+    parser.add_argument('modules', nargs='?', default=os.curdir, help='directory of the generated modules')
+    parser.add_argument('-m', '--meta', required=True, help='aci meta json file or meta store for the mock')
+    parser.add_argument('--ansible', help='directory added to PYTHONPATH, e.g. the lib directory of Ansible 2.6')
+    parser.add_argument('--python', default=sys.executable, help='interpreter running the modules')
+    parser.add_argument('--query-module', default='auto_fvEPg.py',
+                        help='read-only module of fvEPg, relative to the modules directory')
+    parser.add_argument('--aggregate-module', default='auto_fvBD.py',
+                        help='read/write module of fvBD generated with --aggregate, relative to the modules directory')
+    args = parser.parse_args()
+
+    checks = []
+    for module, run_checks in ((args.query_module, check_query), (args.aggregate_module, check_aggregate)):
+        path = os.path.join(args.modules, module)
+        if not os.path.isfile(path):
+            parser.error("no module {}".format(path))
+        checks.append((path, run_checks))
+
+    runner = ModuleRunner(load_classes(args.meta), args.python, args.ansible)
+    try:
+        results = []
+        for path, run_checks in checks:
+            results.extend(run_checks(runner, path))
+    finally:
+        runner.close()
+
+    failures = 0
+    for check, problem in results:
+        if problem:
+            failures += 1
+            print("FAIL {}: {}".format(check, problem))
+    print("{} of {} checks passed".format(len(results) - failures, len(results)))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
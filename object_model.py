@@ -1,6 +1,14 @@
+import heapq
 import re
 import requests
 import json
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from html import unescape
+
+import instrumentation
+from containment_graph import ContainmentGraph
 
 # Dictionary of Regex Patterns to pull properties from documentation html files:
 rp = {  'abstract': re.compile("Class (.*?) \((\w+)\)"),
@@ -14,7 +22,7 @@ rp = {  'abstract': re.compile("Class (.*?) \((\w+)\)"),
         'dn_prefix_prop': re.compile("(\w+)?-?(\{\[?(\w+)\]?\})?"),
         'dn_line': re.compile("\[[0-9]*\] (.*)"),
         'dn_classes': re.compile("<a href=\"MO-(\w+).html"),
-        'doc_descr': re.compile("</h4>(.*?)<br/>\s+<br/>.*?NAMING RULE", re.DOTALL),
+        'doc_descr': re.compile("</h4>((?:(?!</h4>).)*?)<br/>\s+<br/>.*?NAMING RULE", re.DOTALL),
         'href': re.compile("href=\"MO-(.*?).html"),
         'label': re.compile("Class Label:(.*)"),
         'prop_name': re.compile("<h3>([a-zA-Z]+)</h3>"),
@@ -22,26 +30,80 @@ rp = {  'abstract': re.compile("Class (.*?) \((\w+)\)"),
         'rn_format': re.compile("RN FORMAT:(.*)"),
         'rn_component': re.compile("\{[?(\w+)]?\}"),
         't_pre': re.compile("<pre>(.*?)</pre>", re.DOTALL),
+        'spaces': re.compile("\s+"),
+        'package': re.compile("[a-z0-9]*"),
         }
 
+# Tokens of interest in a documentation page, matched in one scan by
+# MIM.parse_class_page; patterns inside sections stop at the section end
+page_tokens = re.compile(
+    r'(?P<pre_open><pre>)'
+    r'|(?P<pre_close></pre>)'
+    r'|<h3>(?P<prop>[a-zA-Z]+)</h3>'
+    r'|<a name="(?P<anchor>[^"]*)"'
+    r'|<dd>(?P<dd>(?:(?!<br/>).)*?)</dd>'
+    r'|<font size="-1"> (?P<option>(?:(?!<br/>)[^\n])*?) </font>'
+    r'|(?P<br><br/>)'
+    r'|<strong>(?P<mos>Container|Contained) Mos:'
+    r'|href="MO-(?P<href>(?:(?!<br />)[^\n])*?).html'
+    r'|(?P<br_mos><br />)',
+    re.DOTALL)
+
+# Online documentation page of a class
+DOC_URL = "https://pubhub.devnetcloud.com/media/apic-mim-ref-311/docs/MO-{0}.html"
+
+# Default number of DN formats kept per class; heavily contained classes
+# (relations, faults) can have thousands of paths to topRoot. A record whose
+# DNs were cut off at the limit gets a 'dnLimit' key (see MO.dnLimit)
+DN_LIMIT = 100
+
 class MIM:
     """
     Instance represents the Cisco ACI Management Information Model
     """
 
-    def __init__(self, meta=None):
+    # bump when parse_class_page output changes so cached class entries are rebuilt
+    PARSER_VERSION = 2
+
+    def __init__(self, meta=None, dn_limit=DN_LIMIT, cache=None, doc_url=DOC_URL, graph=None, mo_cache_size=None):
         """
         Creates dictionary containing ACI MIM information
 
         Parameters
         ----------
-        meta : str
-            string contents of the meta json file
+        meta : str or MetaStore
+            string contents of the meta json file, or an indexed meta store
+            (see meta_store.py) whose class records are decoded on first use
             if not provided, class information is pulled through online documentation
-        """
+        dn_limit : int
+            maximum number of DNs listed for a class, shortest first
+            (None for all); only applies when initialized with meta
+        cache : DocCache
+            on-disk cache for the online documentation (see doc_cache.py)
+            if not provided, every class is requested from the documentation site
+        doc_url : str
+            URL of a class documentation page, formatted with the class name
+        graph : ContainmentGraph
+            containment graph of meta (see containment_graph.py), e.g. loaded
+            from disk; built from meta on first use if not provided
+        mo_cache_size : int
+            maximum number of MOs kept, least recently used first out; the
+            cache_size of meta if it is a store with one, else unbounded
+        """
+        self.cache = cache
+        self.doc_url = doc_url
+        self._graph = graph
+        self._mos = OrderedDict() # compact MOs of the classes requested last, least recently used first
+        if mo_cache_size is None:
+            mo_cache_size = getattr(meta, 'cache_size', None) # as many as the records decoded by a store
+        self.mo_cache_size = mo_cache_size
+        self.dn_limit = dn_limit
+        self._dn_depth = {} # memoized distance to topRoot, shared by all classes
 
         if not meta:
             self.meta = {}
+        elif isinstance(meta, Mapping):
+            self.meta = meta
         else:
             metad = json.loads(meta)
             self.meta = metad['classes']
@@ -57,51 +119,335 @@ class MIM:
         MO
             instance corresponding to class_name
         """
-        if class_name not in self.meta: # first request for class when initialized without meta
-            self._add_class(class_name)
-        if 'dnFormat' not in self.meta[class_name]: # first request for class when initialized with meta
-            self._add_dn(class_name)
+        mo = self._mos.get(class_name)
+        if mo is not None:
+            self._mos.move_to_end(class_name)
+            return mo
+        with instrumentation.phase('class_lookup'):
+            if class_name not in self.meta: # first request for class when initialized without meta
+                self._add_class(class_name)
+            record = self.meta[class_name]
+        if 'dnFormat' not in record: # first request for class when initialized with meta
+            with instrumentation.phase('dn_enumeration'):
+                self._add_dn(class_name)
+
+        mo = self._mos[class_name] = MO(class_name, self.meta[class_name])
+        if self.mo_cache_size is not None and len(self._mos) > self.mo_cache_size:
+            self._mos.popitem(last=False)
+        return mo
+
+    @property
+    def graph(self):
+        """containment graph of the classes of the meta"""
+        if self._graph is None:
+            self._graph = ContainmentGraph.from_meta(self.meta)
+        return self._graph
+
+    def iter_classes(self, packages=None, exclude_packages=None, configurable=None, abstract=None, under=None):
+        """
+        Streams the names of the classes of the meta matching the filters
 
-        return MO(class_name, self.meta[class_name])
+        Parameters
+        ----------
+        packages : list
+            package names (e.g. fv, vz) to include; all packages if not provided
+        exclude_packages : list
+            package names to exclude
+        configurable : bool
+            only classes whose isConfigurable equals this, if provided
+        abstract : bool
+            only classes whose isAbstract equals this, if provided
+        under : str
+            only classes contained, directly or not, by this class, if provided
+        Returns
+        -------
+        generator
+            class names, in the order of the meta
+        """
+        below = self.graph.descendants(under) if under else None
+        for class_name in self.meta:
+            if below is not None and class_name not in below:
+                continue
+            package = MIM.package(class_name)
+            if packages and package not in packages:
+                continue
+            if exclude_packages and package in exclude_packages:
+                continue
+            if configurable is not None or abstract is not None:
+                record = self.meta[class_name]
+                if configurable is not None and record['isConfigurable'] != configurable:
+                    continue
+                if abstract is not None and record['isAbstract'] != abstract:
+                    continue
+            yield class_name
+
+    def has_dn(self, class_name):
+        """tells whether the class is contained, directly or not, by topRoot; topRoot itself has no DN"""
+        return self._dn_depth_map(class_name).get(class_name) is not None
+
+    @staticmethod
+    def package(class_name):
+        """returns the package of a class name with no delimiters, e.g. fv for fvTenant"""
+        return rp['package'].match(class_name).group()
 
     def _add_dn(self, class_name):
         """Add the DNs for a specific class, only if initialized by meta file"""
-        dns = []
+        limit = self.dn_limit
+        record = self.meta[class_name]
+        # one more than the limit tells whether DNs are left out
+        dns = list(self.iter_dn(class_name, None if limit is None else limit + 1))
+        if limit is not None and len(dns) > limit:
+            del dns[limit:]
+            record['dnLimit'] = limit
+        record['dnFormat'] = dns
+
+    def iter_dn(self, class_name, limit=None):
+        """
+        Lazily enumerates the DNs of a class, shortest first
 
-        def add_dn_helper(class_name, dn, class_list):
-            """add lists of container hierarchy"""
-            containers = self.meta[class_name]['containers']
-            if len(containers) > 100: # recursion breaks with classes with too many classes TODO: find solution
-                raise ModuleGenerationException("Too many containers")
+        Parameters
+        ----------
+        class_name : str
+            name of ACI class with package name and no delimiters
+        limit : int
+            maximum number of DNs to yield; all DNs if not provided
+        Returns
+        -------
+        generator
+            tuples of (format, classes) in the same form as MO.dnFormat
+        """
+        depth = self._dn_depth_map(class_name)
+        if depth.get(class_name) is None:
+            return
+
+        # best-first search up the containment DAG; depth is the exact distance
+        # to the root so complete paths come out in order of length, and ties
+        # go to the longest partial path so each one is completed depth first.
+        # Partial paths are linked (class, rest) cells sharing common suffixes.
+        count = 0
+        seq = 0
+        heap = [(depth[class_name], -1, seq, (class_name, None))]
+        while heap and (limit is None or count < limit):
+            _, length, _, chain = heapq.heappop(heap)
+            length = -length
+            head = chain[0]
+            containers = self.meta[head]['containers']
+            if 'topRoot' in containers:
+                classes = []
+                while chain is not None:
+                    classes.append(chain[0])
+                    chain = chain[1]
+                yield ('/'.join(self.meta[klass]['rnFormat'] for klass in classes), classes)
+                count += 1
+                continue
+            for mo in containers:
+                if depth.get(mo) is None or MIM._chain_contains(chain, mo):
+                    continue
+                seq += 1
+                heapq.heappush(heap, (length + 1 + depth[mo], -(length + 1), seq, (mo, chain)))
+
+    def _dn_depth_map(self, class_name):
+        """
+        Returns the memoized map of class name to number of containers between
+        the class and topRoot (None if topRoot is unreachable), filled in for
+        every ancestor of class_name
+        """
+        depth = self._dn_depth
+        if class_name in depth:
+            return depth
+
+        # collect the ancestors not yet resolved by earlier calls
+        pending = {}
+        stack = [class_name]
+        while stack:
+            klass = stack.pop()
+            if klass in pending or klass in depth:
+                continue
+            if klass not in self.meta:
+                depth[klass] = None
+                continue
+            containers = list(self.meta[klass]['containers'])
+            pending[klass] = containers
+            if 'topRoot' not in containers:
+                stack.extend(containers)
+
+        # shortest distance to the root over the reversed containment edges
+        children = {}
+        heap = []
+        for klass, containers in pending.items():
             if 'topRoot' in containers:
-                dns.append((dn, class_list))
-                return
+                heap.append((0, klass))
+                continue
             for mo in containers:
-                updated_dn = self.meta[mo]['rnFormat'] + '/' + dn
-                updated_class = class_list[:]
-                updated_class.insert(0, mo)
-                add_dn_helper(mo, updated_dn, updated_class)
+                if mo in pending:
+                    children.setdefault(mo, []).append(klass)
+                elif depth.get(mo) is not None:
+                    heap.append((depth[mo] + 1, klass))
+        heapq.heapify(heap)
+        while heap:
+            dist, klass = heapq.heappop(heap)
+            if klass in depth:
+                continue
+            depth[klass] = dist
+            for child in children.get(klass, ()):
+                if child not in depth:
+                    heapq.heappush(heap, (dist + 1, child))
+        for klass in pending:
+            depth.setdefault(klass, None)
+        return depth
 
-        add_dn_helper(class_name, self.meta[class_name]['rnFormat'], [class_name])
-        self.meta[class_name]['dnFormat'] = dns
+    @staticmethod
+    def _chain_contains(chain, class_name):
+        """returns True if class_name is already part of a partial DN path"""
+        while chain is not None:
+            if chain[0] == class_name:
+                return True
+            chain = chain[1]
+        return False
 
     def _add_class(self, class_name):
         """Adds class entry to self.meta; only if not initiaized by meta file"""
-        r = requests.get("https://pubhub.devnetcloud.com/" + \
-            "media/apic-mim-ref-311/docs/MO-{0}.html".format(class_name))
+        self.meta[class_name] = self.fetch_class(class_name)
+
+    def fetch_class(self, class_name, session=None):
+        """
+        Parameters
+        ----------
+        class_name : str
+            name of ACI class with package name and no delimiters
+        session : requests.Session
+            session used for the request when there is no cache
+        Returns
+        -------
+        dict
+            class entry parsed from the online documentation, not added to self.meta
+        """
+        url = self.doc_url.format(class_name)
+        if self.cache is not None:
+            return self.cache.load(url, MIM.parse_class_page, MIM.PARSER_VERSION)
+
+        r = (session or requests).get(url)
         if r.status_code != 200:
             raise InvalidURLException("class documentation request failed")
-        html = r.text
+        return MIM.parse_class_page(r.text)
+
+    @staticmethod
+    def parse_class_page(html):
+        """
+        Parameters
+        ----------
+        html : str
+            html documentation for an ACI class
+        Returns
+        -------
+        dict
+            class entry in the same form as the classes of the meta file
+        """
+        class_dict = MIM._parse_class_header(html)
+
+        # single pass over the page collecting <pre> blocks, property names,
+        # property sections (<a name=...> up to <br/>) and containment sections
+        # (<strong>... Mos: up to <br />)
+        pres = []
+        pre_start = None
+        prop_names = []
+        prop_sections = {}
+        open_props = []
+        mo_sections = {}
+        open_mos = []
+        for token in page_tokens.finditer(html):
+            kind = token.lastgroup
+            if kind == 'pre_open':
+                if pre_start is None:
+                    pre_start = token.end()
+            elif kind == 'pre_close':
+                if pre_start is not None:
+                    pres.append(html[pre_start:token.start()])
+                    pre_start = None
+            elif kind == 'prop':
+                prop_names.append(token.group('prop'))
+            elif kind == 'anchor':
+                name = token.group('anchor')
+                if name not in prop_sections:
+                    prop_sections[name] = section = {'help': None, 'options': []}
+                    open_props.append(section)
+            elif kind == 'dd':
+                for section in open_props:
+                    if section['help'] is None:
+                        section['help'] = token.group('dd')
+            elif kind == 'option':
+                for section in open_props:
+                    section['options'].append(token.group('option'))
+            elif kind == 'br':
+                del open_props[:]
+            elif kind == 'mos':
+                name = token.group('mos')
+                if name not in mo_sections:
+                    mo_sections[name] = section = []
+                    open_mos.append(section)
+            elif kind == 'href':
+                for section in open_mos:
+                    section.append(token.group('href'))
+            elif kind == 'br_mos':
+                del open_mos[:]
+
+        property_doc_tags = pres[4:] # html doc corresponding to each property; first 4 always other docs, no properties
+        properties = {}
+        for i, cur in enumerate(prop_names):
+            section = prop_sections.get(cur)
+            if section is None or section['help'] is None:
+                raise ModuleGenerationException("no documentation for property {}".format(cur))
+            details = {}
+            details['isConfigurable'] = MIM._is_configurable(property_doc_tags[i])
+            details['options'] = [MIM._clean_text(option) for option in section['options']]
+            details['help'] = MIM._clean_text(section['help'])
+            properties[cur] = details
+        class_dict['properties'] = properties
+
+        class_dict['contains'] = {name: "" for name in mo_sections.get('Contained', [])}
+        class_dict['containers'] = {name: "" for name in mo_sections.get('Container', [])}
+
+        class_dict['dnFormat'] = MIM._parse_dn_format(pres[0])
+        return class_dict
+
+    @staticmethod
+    def _parse_class_header(html):
+        """returns the class attributes found at the top of a documentation page"""
+        class_dict = {}
+        class_dict['label'] = MIM._clean_text(MIM._search_group(rp['label'], html, 1))
+        class_dict['name'] = MIM._search_group(rp['abstract'], html, 1)
+        class_dict['isAbstract'] = MIM._search_group(rp['abstract'], html, 2) == 'ABSTRACT'
+        class_dict['isConfigurable'] = MIM._search_group(rp['configurable'], html, 1) == 'true'
+        class_dict['isDeletable'] = True if MIM._search_group(rp['del'], html, 1) == 'yes' else False
+        class_dict['help'] = MIM._clean_text(MIM._search_group(rp['doc_descr'], html, 1))
+
+        rn_text = MIM._search_group(rp['rn_format'], html, 1)
+        rn_text = MIM._clean_html(rn_text)
+        class_dict['identifiedBy'] = rp['rn_component'].findall(rn_text)
+        class_dict['rnFormat'] = rn_text
+        return class_dict
+
+    @staticmethod
+    def _parse_dn_format(name_text):
+        """returns the dnFormat list from the naming <pre> block of a documentation page"""
+        dn_text = rp['dn_format'].search(name_text).group(1)
+        dn_lines = rp['dn_line'].findall(dn_text)
+        return [(MIM._clean_html(line), rp['dn_classes'].findall(line)) for line in dn_lines]
 
+    @staticmethod
+    def _parse_class_page_regex(html):
+        """
+        Reference implementation of parse_class_page rescanning the page for
+        every property; kept to check the single pass parser against saved pages
+        """
         class_dict = {}
         # initiaize class attributes
-        class_dict['label'] = MIM._search_group(rp['label'], html, 1)
+        class_dict['label'] = MIM._clean_text(MIM._search_group(rp['label'], html, 1))
         class_dict['name'] = MIM._search_group(rp['abstract'], html, 1)
-        print(MIM._search_group(rp['abstract'], html, 2))
         class_dict['isAbstract'] = MIM._search_group(rp['abstract'], html, 2) == 'ABSTRACT'
         class_dict['isConfigurable'] = MIM._search_group(rp['configurable'], html, 1) == 'true'
         class_dict['isDeletable'] = True if MIM._search_group(rp['del'], html, 1) == 'yes' else False
-        class_dict['help'] = MIM._search_group(rp['doc_descr'], html, 1)
+        class_dict['help'] = MIM._clean_text(MIM._search_group(rp['doc_descr'], html, 1))
 
         rn_text = MIM._search_group(rp['rn_format'], html, 1)
         rn_text = MIM._clean_html(rn_text)
@@ -118,11 +464,11 @@ class MIM:
         for i in range(num_total):
             cur = all_properties[i]
             details = {}
-            details['isConfigurable'] = "admin" in property_doc_tags[i] or "naming" in property_doc_tags[i]
+            details['isConfigurable'] = MIM._is_configurable(property_doc_tags[i])
             options = MIM._get_property_details(cur, html)
             details['options'] = options
             # details['options'] = {option: option for option in options} # old format, dict
-            details['help'] = self._get_property_comments(cur, html)
+            details['help'] = MIM._get_property_comments(cur, html)
             properties[cur] = details
         class_dict['properties'] = properties
 
@@ -154,7 +500,7 @@ class MIM:
         class_dict['dnFormat'] = [(MIM._clean_html(line), rp['dn_classes'].findall(line)) for line in dn_lines]
         # list(map(MIM._clean_html, rp['dn_line'].findall(dn_text)))
 
-        self.meta[class_name] = class_dict
+        return class_dict
 
     @staticmethod
     def _get_property_comments(property_name, doc_text):
@@ -175,9 +521,7 @@ class MIM:
         text = re_pd.search(doc_text).group()
 
         re_des = re.compile("<dd>(.*?)</dd>", re.DOTALL)
-        descr = re_des.search(text).group(1).strip()
-        descr = re.sub("\n", " ", descr)  # removing excess whitespace
-        return re.sub("\s+", " ", descr)
+        return MIM._clean_text(re_des.search(text).group(1))
 
     @staticmethod
     def _get_property_details(property_name, html):
@@ -199,13 +543,25 @@ class MIM:
         text = re_pd.search(html).group()
 
         val = rp['prop_options'].findall(text)
-        return val
+        return [MIM._clean_text(option) for option in val]
 
     @staticmethod
     def _clean_html(raw_html):
         """removes html brackets"""
         return re.sub(rp['cleanr'], "", raw_html)
 
+    @staticmethod
+    def _is_configurable(doc_tag):
+        """tells from the type and access of a property (e.g. naming:Descr admin) whether it can be set"""
+        return doc_tag.split()[-1:] in (['admin'], ['naming']) # the access, not the namespace of the type
+
+    @staticmethod
+    def _clean_text(raw_html):
+        """returns the text of an html fragment: tags dropped, entities decoded and whitespace collapsed"""
+        # tags become spaces so that table cells do not run together
+        text = unescape(re.sub(rp['cleanr'], " ", raw_html))
+        return rp['spaces'].sub(" ", text).strip()
+
     @staticmethod
     def _search_group(regex, text, group):
         """
@@ -220,27 +576,201 @@ class MIM:
 
 
 
+# Strings and option lists shared by all MOs of a process; the same property
+# names, help texts and options recur across thousands of classes
+_options = {}
+
+
+def _intern(text):
+    return sys.intern(text) if type(text) is str else text
+
+
+def _intern_options(options):
+    if not options:
+        return ()
+    key = tuple(options)
+    shared = _options.get(key)
+    if shared is None:
+        shared = _options[key] = tuple(_intern(option) for option in options)
+    return shared
+
+
+class Property:
+    """
+    One property of an MO, also usable as the property dict of the meta file
+    ('isConfigurable', 'help', 'options', 'label')
+    """
+    __slots__ = ('name', 'isConfigurable', 'help', 'options', 'label')
+
+    _keys = ('isConfigurable', 'help', 'options', 'label')
+
+    def __init__(self, name, isConfigurable, help, options, label=None):
+        self.name = name
+        self.isConfigurable = isConfigurable
+        self.help = help
+        self.options = options # tuple shared between properties with the same options
+        self.label = label
+
+    def __getitem__(self, key):
+        if key not in Property._keys or (key == 'label' and self.label is None):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in Property._keys if key != 'label' or self.label is not None]
+
+    def to_dict(self):
+        return {key: list(self[key]) if key == 'options' else self[key] for key in self.keys()}
+
+
+# column of each property name, shared by the MOs with the same property names
+_columns = {}
+
+def _column_index(names):
+    """returns the {name: column} dict shared by the MOs whose property names are names"""
+    index = _columns.get(names)
+    if index is None:
+        index = _columns[names] = {name: i for i, name in enumerate(names)}
+    return index
+
+
+class Properties(Mapping):
+    """
+    Read-only mapping of property name to Property over the columns of an MO
+    """
+    __slots__ = ('_mo',)
+
+    def __init__(self, mo):
+        self._mo = mo
+
+    def __getitem__(self, name):
+        return self._mo._property_views()[self._mo._prop_index[name]]
+
+    def __contains__(self, name):
+        return name in self._mo._prop_index
+
+    def __iter__(self):
+        return iter(self._mo._prop_names)
+
+    def __len__(self):
+        return len(self._mo._prop_names)
+
+    def items(self):
+        return list(zip(self._mo._prop_names, self._mo._property_views()))
+
+
 class MO:
+    """
+    Compact representation of an ACI class built from its meta record
+
+    Properties are stored column-wise, one tuple per attribute, and names,
+    help texts and options are interned, so that holding the MOs of a whole
+    model costs a fraction of the decoded records.
+    """
+    __slots__ = ('klass', '_label', '_name', '_help', '_flags', '_identified_by', '_rn_format',
+                 '_containers', '_contains', '_dn_format', '_extra',
+                 '_prop_names', '_prop_configurable', '_prop_help', '_prop_options', '_prop_labels',
+                 '_prop_index', '_prop_views')
+
+    # keys of a meta record held in slots; others are kept as they are in _extra
+    _KEYS = ('label', 'name', 'help', 'isAbstract', 'isConfigurable', 'isDeletable', 'identifiedBy',
+             'rnFormat', 'containers', 'contains', 'dnFormat', 'properties')
+
     def __init__(self, klass, meta):
-        self.klass = klass # class name with no colon between package
-        self.meta = meta
+        """
+        Parameters
+        ----------
+        klass : str
+            class name with no colon between package
+        meta : dict
+            record of the class in the form of aci-meta.json
+        """
+        self.klass = _intern(klass) # class name with no colon between package
+        self._label = _intern(meta['label'])
+        self._name = _intern(meta['name'])
+        self._help = _intern(meta['help'])
+        self._flags = (meta['isAbstract'], meta['isConfigurable'], meta['isDeletable'])
+        self._identified_by = tuple(_intern(prop) for prop in meta['identifiedBy'])
+        self._rn_format = _intern(meta['rnFormat'])
+        self._containers = tuple(_intern(name) for name in meta['containers'])
+        self._contains = tuple(_intern(name) for name in meta['contains'])
+        self._dn_format = meta.get('dnFormat')
+        extra = {key: value for key, value in meta.items() if key not in MO._KEYS}
+        self._extra = extra or None
+
+        intern = sys.intern
+        names, configurable, helps, options, labels = [], [], [], [], []
+        for name, prop in meta['properties'].items():
+            names.append(intern(name))
+            configurable.append(prop['isConfigurable'])
+            helps.append(_intern(prop['help']))
+            options.append(_intern_options(prop['options']))
+            labels.append(_intern(prop.get('label')))
+        self._prop_names = tuple(names)
+        self._prop_configurable = tuple(configurable)
+        self._prop_help = tuple(helps)
+        self._prop_options = tuple(options)
+        self._prop_labels = tuple(labels) if any(label is not None for label in labels) else None
+        self._prop_index = _column_index(self._prop_names)
+        self._prop_views = None
+
+    def _property_views(self):
+        """returns the Property of every column, built on first use"""
+        if self._prop_views is None:
+            labels = self._prop_labels or (None,) * len(self._prop_names)
+            self._prop_views = tuple(Property(name, configurable, help, options, label)
+                                     for name, configurable, help, options, label
+                                     in zip(self._prop_names, self._prop_configurable, self._prop_help,
+                                            self._prop_options, labels))
+        return self._prop_views
 
     def __eq__(self, other):
         return self.klass == other.klass
 
+    def __reduce__(self):
+        # rebuilt from the record so that strings are interned in the receiving process
+        return (MO, (self.klass, self.meta))
+
     @property
-    def properties(self):
+    def meta(self):
         """
         Returns
         -------
         dict
+            record of the class in the form of aci-meta.json, rebuilt on each access
+        """
+        meta = {'label': self._label, 'name': self._name, 'help': self._help,
+                'isAbstract': self.isAbstract, 'isConfigurable': self.isConfigurable,
+                'isDeletable': self.isDeletable, 'identifiedBy': list(self._identified_by),
+                'rnFormat': self._rn_format,
+                'containers': dict.fromkeys(self._containers, ''),
+                'contains': dict.fromkeys(self._contains, ''),
+                'properties': {name: prop.to_dict() for name, prop in self.properties.items()}}
+        if self._dn_format is not None:
+            meta['dnFormat'] = self._dn_format
+        if self._extra:
+            meta.update(self._extra)
+        return meta
+
+    @property
+    def properties(self):
+        """
+        Returns
+        -------
+        Mapping
             keys are all property names for the class
-            values are dicts with keys:
+            values are Property views, also indexable with the keys:
                 'isConfigurable': bool
                 'help': str
-                'options': dict - key and values are strings of option names
+                'options': tuple - strings of option names
         """
-        return self.meta['properties']
+        return Properties(self)
 
     @property
     def containers(self):
@@ -250,7 +780,7 @@ class MO:
         list
             list of strings: class names of all container classes
         """
-        return list(self.meta['containers'].keys())
+        return list(self._containers)
 
     @property
     def contains(self):
@@ -260,7 +790,7 @@ class MO:
         list
             list of strings: class names of all contained classes
         """
-        return list(self.meta['contains'].keys())
+        return list(self._contains)
 
     @property
     def dnFormat(self):
@@ -274,7 +804,20 @@ class MO:
                 classes: list
                     names of correspoding classes in the DN
         """
-        return self.meta['dnFormat']
+        if self._dn_format is None:
+            raise KeyError('dnFormat')
+        return self._dn_format
+
+    @property
+    def dnLimit(self):
+        """
+        Returns
+        -------
+        int
+            number of DN formats dnFormat was cut off at, further DNs of the
+            class being left out; None if dnFormat lists every DN
+        """
+        return self._extra.get('dnLimit') if self._extra else None
 
     @property
     def identifiedBy(self):
@@ -284,7 +827,7 @@ class MO:
         list
             list of strings: ordered naming properties
         """
-        return self.meta['identifiedBy']
+        return list(self._identified_by)
 
 
     @property
@@ -295,7 +838,7 @@ class MO:
         bool
             true if class is abstract
         """
-        return self.meta['isAbstract']
+        return self._flags[0]
 
     @property
     def isConfigurable(self):
@@ -305,7 +848,7 @@ class MO:
         bool
             true if class is configurable
         """
-        return self.meta['isConfigurable']
+        return self._flags[1]
 
     @property
     def isDeletable(self):
@@ -315,7 +858,7 @@ class MO:
         bool
             true if class is deletable
         """
-        return self.meta['isDeletable']
+        return self._flags[2]
 
     @property
     def label(self):
@@ -325,7 +868,7 @@ class MO:
         str
             class label
         """
-        return self.meta['label']
+        return self._label
 
     @property
     def name(self):
@@ -335,7 +878,7 @@ class MO:
         str
             package and class name separated with a colon
         """
-        return self.meta['name']
+        return self._name
 
     @property
     def rnFormat(self):
@@ -345,7 +888,7 @@ class MO:
         str
             relative name format
         """
-        return self.meta['rnFormat']
+        return self._rn_format
 
     @property
     def help(self):
@@ -355,7 +898,7 @@ class MO:
         str
             class description
         """
-        return self.meta['help']
+        return self._help
 
 
 class ModuleGenerationException(Exception):
@@ -369,3 +912,7 @@ class InvalidDNException(ModuleGenerationException):
 class InvalidURLException(ModuleGenerationException):
     def __init__(self, *args, **kwargs):
         ModuleGenerationException.__init__(self,*args,**kwargs)
+
+class CacheMissException(InvalidURLException):
+    def __init__(self, *args, **kwargs):
+        InvalidURLException.__init__(self,*args,**kwargs)
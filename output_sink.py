@@ -0,0 +1,322 @@
+"""
+Destinations of generated modules
+
+ansible_model hands every rendered module to a sink instead of writing it
+into the working directory. Nothing a sink receives is visible at its
+destination before commit(), and abort() discards it, so a run failing
+before commit leaves the previous output as it was. Modules are rendered
+straight into the file object of open(); a shared sink can also be written
+by worker processes, the others get the modules from the parent process.
+
+DirectorySink
+    shared; stages files in a temporary directory next to the destination, flushes
+    them to disk with one pass of fsync at commit and renames them into place
+    one by one: every file is replaced atomically, but a commit interrupted
+    midway leaves some files new and the others old. Staging directories
+    left behind by runs that were killed are removed by the next run on the
+    same host; on a directory shared between hosts, those of other hosts are
+    only removed once untouched for STALE_SECONDS, as their process cannot
+    be checked
+ArchiveSink
+    streams files into a tar (optionally compressed) or zip archive, renamed
+    into place at commit
+MemorySink
+    keeps files in a dict, for tests and long running processes
+"""
+
+import io
+import os
+import shutil
+import socket
+import tarfile
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+
+# staging directories of DirectorySink are named .autogen-<host>-<pid>-<random>
+STAGING_PREFIX = '.autogen-'
+
+# age of the staging directory of another host after which its run is taken as gone
+STALE_SECONDS = 24 * 3600
+
+ARCHIVE_MODES = (('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.tar.bz2', 'w:bz2'), ('.tar.xz', 'w:xz'),
+                 ('.tar', 'w'), ('.zip', None))
+
+
+class OutputSink:
+    """
+    Base of the sinks; a sink is also a context manager committing on success
+    and aborting on error
+    """
+
+    # True if copies of the sink in worker processes can write into it
+    shared = False
+
+    @contextmanager
+    def open(self, name):
+        """
+        yields a text file object the content of file name is written to, as
+        by write(); nothing is written if the block raises
+        """
+        f = io.StringIO()
+        yield f
+        self.write(name, f.getvalue())
+
+    def write(self, name, content):
+        """
+        Parameters
+        ----------
+        name : str
+            relative path of the file, e.g. auto_fvBD.py
+        content : str
+            text of the file
+        """
+        raise NotImplementedError
+
+    def exists(self, name):
+        """returns True if name will be in the output after commit, without being written again"""
+        raise NotImplementedError
+
+    def commit(self):
+        """makes everything written visible at the destination"""
+
+    def abort(self):
+        """discards everything written since the sink was opened"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class DirectorySink(OutputSink):
+    """
+    Instance writes files into a directory atomically
+    """
+
+    shared = True # staged files are found at commit, whichever process wrote them
+
+    def __init__(self, directory=os.curdir, fsync=True):
+        """
+        Parameters
+        ----------
+        directory : str
+            destination directory, created if needed
+        fsync : bool
+            flush the files to disk before renaming them into place
+        """
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        remove_stale_staging(directory)
+        # on the same filesystem as the destination so that renames are atomic
+        self.staging = tempfile.mkdtemp(prefix='{}{}-{}-'.format(STAGING_PREFIX, socket.gethostname(), os.getpid()),
+                                        dir=directory)
+
+    @contextmanager
+    def open(self, name):
+        path = os.path.join(self.staging, name)
+        if os.path.dirname(name):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path, 'w') as f:
+                yield f
+        except BaseException:
+            os.remove(path) # no partial file is committed
+            raise
+
+    def write(self, name, content):
+        with self.open(name) as f:
+            f.write(content)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def commit(self):
+        if self.staging is None:
+            return
+        staged = self._staged()
+        if self.fsync:
+            # one pass once everything is written rather than a sync per file
+            for name in staged:
+                fd = os.open(os.path.join(self.staging, name), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        directories = set()
+        for name in staged:
+            target = os.path.join(self.directory, name)
+            if os.path.dirname(name):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(self.staging, name), target)
+            directories.add(os.path.dirname(target) or os.curdir)
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            for directory in directories: # make the renames durable
+                fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        self.abort()
+
+    def abort(self):
+        if self.staging is not None:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            self.staging = None
+
+    def _staged(self):
+        """returns the relative paths of the files staged, by this process or by workers"""
+        names = []
+        for root, _, files in os.walk(self.staging):
+            for file_name in files:
+                names.append(os.path.relpath(os.path.join(root, file_name), self.staging))
+        return names
+
+
+class ArchiveSink(OutputSink):
+    """
+    Instance streams files into a tar or zip archive
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            archive to write; the format follows the extension (see ARCHIVE_MODES)
+        """
+        self.path = path
+        self.names = set()
+        self.tmp = path + '.tmp'
+        mode = archive_mode(path)
+        if mode is None:
+            self.archive = zipfile.ZipFile(self.tmp, 'w', zipfile.ZIP_DEFLATED)
+            self.tar = False
+        else:
+            self.archive = tarfile.open(self.tmp, mode)
+            self.tar = True
+
+    def write(self, name, content):
+        data = content.encode('utf-8')
+        if self.tar:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            info.mode = 0o644
+            self.archive.addfile(info, io.BytesIO(data))
+        else:
+            self.archive.writestr(name, data)
+        self.names.add(name)
+
+    def exists(self, name):
+        # the archive is written anew, so only files written in this run are in it
+        return name in self.names
+
+    def __getstate__(self):
+        # copies sent to worker processes only answer exists()
+        state = dict(self.__dict__)
+        state['archive'] = None
+        return state
+
+    def commit(self):
+        if self.archive is None:
+            return
+        self.archive.close()
+        self.archive = None
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+            os.remove(self.tmp)
+
+
+class MemorySink(OutputSink):
+    """
+    Instance keeps files in memory; files holds the committed ones by name
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.pending = {}
+
+    def write(self, name, content):
+        self.pending[name] = content
+
+    def exists(self, name):
+        return name in self.files or name in self.pending
+
+    def commit(self):
+        self.files.update(self.pending)
+        self.pending = {}
+
+    def abort(self):
+        self.pending = {}
+
+
+def _running(pid):
+    """returns True if process pid may still be running"""
+    if pid == os.getpid() or os.name == 'nt': # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # running as another user
+        pass
+    return True
+
+
+def remove_stale_staging(directory):
+    """
+    removes the staging directories of DirectorySink in directory whose process
+    is gone: those of this host whose process is not running, and those of
+    other hosts (or from an older naming) not modified for STALE_SECONDS
+    """
+    host = socket.gethostname()
+    now = time.time()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.startswith(STAGING_PREFIX) or not os.path.isdir(path):
+            continue # e.g. the build manifest, .autogen-manifest.json
+        # the random part of mkdtemp has no '-', the host name may
+        parts = name[len(STAGING_PREFIX):].rsplit('-', 2)
+        if len(parts) == 3 and parts[0] == host and parts[1].isdigit():
+            if _running(int(parts[1])):
+                continue
+        else:
+            try:
+                if now - os.path.getmtime(path) < STALE_SECONDS:
+                    continue
+            except OSError: # removed meanwhile
+                continue
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def archive_mode(path):
+    """returns the tarfile mode for an archive path, None for zip; raises ValueError if not an archive"""
+    for extension, mode in ARCHIVE_MODES:
+        if path.endswith(extension):
+            return mode
+    raise ValueError("{} is not a .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz or .zip path".format(path))
+
+
+def is_archive(path):
+    """tells whether path has an archive extension"""
+    try:
+        archive_mode(path)
+    except ValueError:
+        return False
+    return True
+
+
+def open_sink(path):
+    """returns an ArchiveSink if path has an archive extension, else a DirectorySink"""
+    return ArchiveSink(path) if is_archive(path) else DirectorySink(path)
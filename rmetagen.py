@@ -2,20 +2,56 @@
 
 from __future__ import print_function
 from scp import SCPClient
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import argparse
 import getpass
+import gzip
+import hashlib
 import inspect
 import os
 import paramiko
 import errno
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# local cache of generated meta, one aci-meta.<version>.json per APIC version
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.aci-meta')
+
+REMOTE_SCRIPT = '/tmp/metagen.py'
+REMOTE_META = '/tmp/aci-meta.json.gz'
+
+# APICs handled at once in fleet mode
+DEFAULT_FLEET_WORKERS = 8
+
+
+class RemoteCommandError(Exception):
+    """
+    Raised when a command run on the APIC exits with a non-zero status
+    """
+
+
+class ChecksumError(Exception):
+    """
+    Raised when the downloaded meta does not match the checksum computed on the APIC
+    """
 
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Generate pyaci meta from APIC')
 
-    parser.add_argument('host', nargs=1,
+    parser.add_argument('host', nargs='?',
                         help='hostname of APIC')
+    parser.add_argument('-i', '--inventory',
+                        help='file of APICs to harvest instead of host, one [user@]host[:port] per line')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_FLEET_WORKERS,
+                        help='APICs handled concurrently with --inventory')
+    parser.add_argument('-t', '--timeout', type=float,
+                        help='seconds allowed per APIC and step (connect, version, metagen run)')
     parser.add_argument('-P', '--port', type=int, default=22,
                         help='SSH port of APIC')
 
@@ -27,44 +63,373 @@ def parse_args():
     parser.add_argument('-d', '--default', action='store_true',
                         help='set as default meta')
 
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help='directory of meta cached by APIC version')
+    parser.add_argument('--refresh', action='store_true',
+                        help='regenerate the meta even if the version is cached')
+
     args = parser.parse_args()
+    if (args.host is None) == (args.inventory is None):
+        parser.error('specify either host or --inventory')
 
     if args.password is None:
         args.password = getpass.getpass('Enter {} password for {}: '.format(
-            args.user, args.host[0]))
+            args.user, args.host or args.inventory))
 
     return args
 
 
-def main():
-    args = parse_args()
+def run_command(ssh, command, timeout=None):
+    """
+    Runs command on the APIC
 
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(args.host[0], port=args.port, username=args.user,
-                password=args.password, allow_agent=False,
-                look_for_keys=False)
-    stdin, stdout, stderr = ssh.exec_command('acidiag version')
-    version = ''.join(stdout.readlines()).strip()
+    Parameters
+    ----------
+    ssh : paramiko.SSHClient
+        or any object with a compatible exec_command
+    command : str
+        shell command
+    timeout : float
+        seconds a read from the command may block before socket.timeout is
+        raised; no limit if not provided
+    Returns
+    -------
+    str
+        standard output of the command
+    """
+    if timeout is not None:
+        stdin, stdout, stderr = ssh.exec_command(command, timeout=timeout)
+    else:
+        stdin, stdout, stderr = ssh.exec_command(command)
+    output = ''.join(stdout.readlines()).strip()
+    status = stdout.channel.recv_exit_status()
+    if status != 0:
+        raise RemoteCommandError('{} exited with status {}: {}'.format(
+            command, status, ''.join(stderr.readlines()).strip()))
+    return output
+
+
+def get_version(ssh, timeout=None):
+    """returns the version of the APIC, e.g. 3.1(2m)"""
+    version = run_command(ssh, 'acidiag version', timeout)
     vlist = version.split('.')
-    version = '{}.{}({})'.format(vlist[0], vlist[1], '.'.join(vlist[2:]))
-    print('APIC is running version', version)
+    return '{}.{}({})'.format(vlist[0], vlist[1], '.'.join(vlist[2:]))
 
+
+def cache_path(cache_dir, version):
+    return os.path.join(cache_dir, 'aci-meta.{}.json'.format(version))
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generate_meta(ssh, scp, destination, timeout=None, commit=os.rename):
+    """
+    Runs metagen.py on the APIC and downloads its gzipped output, verified
+    against a sha256 computed on the APIC, into destination
+
+    Parameters
+    ----------
+    ssh : paramiko.SSHClient
+        or any object with a compatible exec_command
+    scp : SCPClient
+        or any object with compatible put and get
+    destination : str
+        path of the uncompressed meta to write
+    timeout : float
+        seconds each command run on the APIC may block, see run_command
+    commit : callable
+        moves the verified meta, commit(temporary path, destination); may
+        raise to leave destination untouched
+    """
     print('Copying metagen.py to APIC')
-    scp = SCPClient(ssh.get_transport())
     filename = inspect.getframeinfo(inspect.currentframe()).filename
     script_dir = os.path.dirname(os.path.abspath(filename))
     metagen_path = os.path.join(script_dir, 'metagen.py')
-    scp.put(metagen_path, '/tmp/metagen.py')
+    scp.put(metagen_path, REMOTE_SCRIPT)
 
     print('Invoking metagen.py on APIC')
-    stdin, stdout, stderr = ssh.exec_command('python2.7 /tmp/metagen.py')
-    ''.join(stdout.readlines()).strip()
-    # TODO (2015-09-14, Praveen Kumar): Check the exit status properly.
+    run_command(ssh, 'cd /tmp && python2.7 {} --gzip --compact -o {}'.format(REMOTE_SCRIPT, REMOTE_META), timeout)
+    remote_digest = run_command(ssh, 'sha256sum {}'.format(REMOTE_META), timeout).split()[0]
 
-    destination = os.getcwd() + "/aci-meta.json"
     print('Copying generated meta from APIC to', destination)
-    scp.get('aci-meta.json', destination)
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, compressed = tempfile.mkstemp(suffix='.json.gz', dir=directory)
+    os.close(fd)
+    fd, uncompressed = tempfile.mkstemp(suffix='.json', dir=directory)
+    os.close(fd)
+    try:
+        scp.get(REMOTE_META, compressed)
+        local_digest = sha256(compressed)
+        if local_digest != remote_digest:
+            raise ChecksumError('sha256 of downloaded meta is {}, expected {}'.format(
+                local_digest, remote_digest))
+        with gzip.open(compressed, 'rb') as src, open(uncompressed, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        commit(uncompressed, destination)
+    finally:
+        for path in (compressed, uncompressed):
+            if os.path.exists(path):
+                os.remove(path)
+    run_command(ssh, 'rm -f {} {}'.format(REMOTE_SCRIPT, REMOTE_META), timeout)
+
+
+def harvest(ssh, scp, cache_dir=DEFAULT_CACHE_DIR, refresh=False, timeout=None):
+    """
+    Returns the path of the cached meta of the APIC behind ssh, generating
+    it on the APIC only if its version is not cached yet (or refresh is set)
+    timeout bounds every command run on the APIC, see run_command
+
+    Returns
+    -------
+    (str, str)
+        APIC version and path of its meta
+    """
+    version = get_version(ssh, timeout)
+    print('APIC is running version', version)
+    path = cache_path(cache_dir, version)
+    if os.path.exists(path) and not refresh:
+        print('Using cached meta', path)
+        return version, path
+
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    generate_meta(ssh, scp, path, timeout)
+    return version, path
+
+
+def parse_inventory(path):
+    """
+    Returns
+    -------
+    list
+        (host, port, user) of every [user@]host[:port] line of the inventory,
+        port and user being None when not given; blank lines and # comments
+        are skipped
+    """
+    hosts = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            user, _, address = line.rpartition('@')
+            host, _, port = address.partition(':')
+            entry = (host, int(port) if port else None, user or None)
+            if entry not in hosts:
+                hosts.append(entry)
+    return hosts
+
+
+def connect(host, port=22, user='admin', password=None, timeout=None):
+    """returns (ssh, scp) clients connected to host"""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(host, port=port, username=user,
+                password=password, allow_agent=False,
+                look_for_keys=False, timeout=timeout,
+                banner_timeout=timeout, auth_timeout=timeout)
+    if timeout is not None:
+        scp = SCPClient(ssh.get_transport(), socket_timeout=timeout)
+    else:
+        scp = SCPClient(ssh.get_transport())
+    return ssh, scp
+
+
+def _run_all(pool, keys, func, timeout=None, expire=None):
+    """
+    Runs func(key) for every key on pool, giving up on a key once its call
+    has run for longer than timeout seconds; expire(key) is then called to
+    abort the call (e.g. by closing its ssh session)
+
+    Returns
+    -------
+    (dict, dict)
+        results and error messages by key
+    """
+    started = {}
+
+    def task(key):
+        started[key] = time.time()
+        return func(key)
+
+    futures = {pool.submit(task, key): key for key in keys}
+    results, errors = {}, {}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=1.0 if timeout else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = '{}: {}'.format(type(e).__name__, e)
+        if timeout:
+            now = time.time()
+            for future in list(pending):
+                key = futures[future]
+                if key in started and now - started[key] > timeout:
+                    pending.discard(future)
+                    errors[key] = 'timed out after {}s'.format(timeout)
+                    if expire is not None:
+                        expire(key)
+    return results, errors
+
+
+def harvest_fleet(hosts, connect, cache_dir=DEFAULT_CACHE_DIR, refresh=False,
+                  workers=DEFAULT_FLEET_WORKERS, timeout=None):
+    """
+    Detects the version of every APIC concurrently and generates the meta of
+    each version not cached yet on one APIC running it, trying the next APIC
+    of the same version if that fails
+
+    Parameters
+    ----------
+    hosts : list
+        hosts as understood by connect
+    connect : callable
+        returns (ssh, scp) clients for a host
+    workers : int
+        number of APICs handled at once
+    timeout : float
+        seconds allowed for connecting and reading the version of an APIC,
+        and for generating the meta of a version; each command run on an
+        APIC is also bounded by it, so that abandoned threads end, and the
+        results of abandoned calls are discarded
+    Returns
+    -------
+    (dict, dict, dict)
+        version by host, meta path by version and error message by host
+    """
+    sessions = {}
+    active = {} # version -> host generating its meta
+    abandoned = set() # hosts and versions given up on by _run_all
+    lock = threading.Lock()
+
+    def close(host):
+        with lock:
+            session = sessions.pop(host, None)
+        if session is not None:
+            session[0].close()
+
+    def abandon_host(host):
+        with lock:
+            abandoned.add(host)
+        close(host)
+
+    def abandon_version(version):
+        with lock:
+            abandoned.add(version)
+            host = active.get(version)
+        close(host)
+
+    def detect(host):
+        session = connect(host)
+        with lock:
+            if host not in abandoned:
+                sessions[host] = session
+                session = None
+        if session is not None: # connected after the host timed out
+            session[0].close()
+            raise RemoteCommandError('{} was abandoned'.format(host))
+        return get_version(sessions[host][0], timeout)
+
+    def generate(version):
+        path = cache_path(cache_dir, version)
+
+        def commit(source, destination):
+            # under the lock, so that the version cannot be abandoned in between
+            with lock:
+                if version in abandoned:
+                    raise RemoteCommandError('meta of {} was abandoned'.format(version))
+                os.rename(source, destination)
+
+        error = None
+        for host in groups[version]:
+            with lock:
+                if version in abandoned:
+                    break
+                session = sessions.get(host)
+                active[version] = host
+            if session is None:
+                continue
+            print('Generating meta for', version, 'on', host)
+            try:
+                generate_meta(session[0], session[1], path, timeout, commit)
+                return path
+            except Exception as e:
+                error = e
+        raise error or RemoteCommandError('no session left for version {}'.format(version))
+
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        versions, errors = _run_all(pool, hosts, detect, timeout, abandon_host)
+        groups = OrderedDict()
+        for host in hosts:
+            if host in versions:
+                groups.setdefault(versions[host], []).append(host)
+
+        metas = {}
+        for version in groups:
+            path = cache_path(cache_dir, version)
+            if os.path.exists(path) and not refresh:
+                metas[version] = path
+        missing = [version for version in groups if version not in metas]
+        generated, failed = _run_all(pool, missing, generate, timeout, abandon_version)
+        metas.update(generated)
+        for version, message in failed.items():
+            for host in groups[version]:
+                errors[host] = message
+    finally:
+        for host in list(sessions):
+            close(host)
+        pool.shutdown(wait=False)
+    return versions, metas, errors
+
+
+def main():
+    args = parse_args()
+
+    if args.inventory:
+        def connect_host(entry):
+            host, port, user = entry
+            return connect(host, port or args.port, user or args.user, args.password, args.timeout)
+
+        hosts = parse_inventory(args.inventory)
+        versions, metas, errors = harvest_fleet(hosts, connect_host, args.cache_dir, args.refresh,
+                                                args.workers, args.timeout)
+        for entry in hosts:
+            if entry in errors:
+                print('{}: {}'.format(entry[0], errors[entry]), file=sys.stderr)
+            else:
+                print('{}: {} {}'.format(entry[0], versions[entry], metas[versions[entry]]))
+        if errors:
+            sys.exit(1)
+        return
+
+    ssh, scp = connect(args.host, args.port, args.user, args.password, args.timeout)
+    try:
+        version, path = harvest(ssh, scp, args.cache_dir, args.refresh, args.timeout)
+    finally:
+        ssh.close()
+
+    destination = os.getcwd() + "/aci-meta.json"
+    print('Copying meta for', version, 'to', destination)
+    shutil.copyfile(path, destination)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Validation of generated modules
+
+Checks every generated module in a pool of processes, right after
+generation (ansible_generator.py --validate) or on its own:
+
+- the module compiles
+- its DOCUMENTATION is valid YAML with an options mapping
+- the options of its argument_spec are the documented options, with the
+  same choices and aliases
+- no required_if entry has an empty list of required options
+
+The argument_spec is read from the module source without importing it, so
+Ansible does not need to be installed. For thin modules it is derived from
+TABLE the way run() of the module_utils runtime does.
+"""
+
+import argparse
+import ast
+import io
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+
+import yaml
+
+from output_sink import archive_mode
+
+# options of the read-only modules, see ansible_2.6_read_only.py.j2
+QUERY_OPTIONS = {
+    'state': (['query'], []),
+    'query_filter': ([], []),
+    'prop_include': (['all', 'config-only', 'naming-only'], []),
+    'page_size': ([], []),
+    'page': ([], []),
+    'max_results': ([], []),
+    'count_only': ([], []),
+}
+
+
+def _assignments(tree):
+    """returns {name: value node} of the module level assignments of tree"""
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            values[node.targets[0].id] = node.value
+    return values
+
+
+def _keyword(call, name):
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+
+def _option(spec):
+    """returns (choices, aliases) of an option given as a dict(...) call"""
+    if not (isinstance(spec, ast.Call) and isinstance(spec.func, ast.Name) and spec.func.id == 'dict'):
+        raise ValueError('option spec is not a dict(...) call')
+    choices, aliases = _keyword(spec, 'choices'), _keyword(spec, 'aliases')
+    return (ast.literal_eval(choices) if choices is not None else [],
+            ast.literal_eval(aliases) if aliases is not None else [])
+
+
+def source_spec(tree):
+    """
+    Parameters
+    ----------
+    tree : ast.Module
+        parsed source of a module calling argument_spec.update and AnsibleModule
+    Returns
+    -------
+    tuple
+        ({option: (choices, aliases)}, required_if) with required_if None if
+        not given
+    """
+    options = {}
+    required_if = None
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        if (isinstance(func, ast.Attribute) and func.attr == 'update'
+                and isinstance(func.value, ast.Name) and func.value.id == 'argument_spec'):
+            for argument in node.args:
+                for key, value in zip(argument.keys, argument.values):
+                    options[ast.literal_eval(key)] = _option(value)
+            for keyword in node.keywords:
+                options[keyword.arg] = _option(keyword.value)
+        elif isinstance(func, ast.Name) and func.id == 'AnsibleModule':
+            value = _keyword(node, 'required_if')
+            if value is not None:
+                required_if = ast.literal_eval(value)
+    return options, required_if
+
+
+def table_spec(table):
+    """
+    returns ({option: (choices, aliases)}, required_if) of a thin module, as
+    built by run() of ansible_2.6_module_utils.py.j2 from its table
+    """
+    if table.get('abstract'):
+        return dict(QUERY_OPTIONS), None
+    aggregate = table.get('aggregate', False)
+    target = table['hierarchy'][-1]
+    naming = []
+    for entry in table['hierarchy']:
+        naming.extend(key for key in entry[2] if key not in naming)
+    required = [key for key in naming if not (aggregate and key in target[2])]
+    options = {}
+    for key, payload, choices, aliases in table['params']:
+        options[key] = (choices, aliases)
+    if aggregate:
+        options['aggregate'] = ([], [])
+        options['aggregate_chunk'] = ([], [])
+    states = ['absent', 'present'] if table['deletable'] else ['present']
+    options['state'] = (states + ['query'], [])
+    return options, [['state', state, required] for state in states] if required else None
+
+
+def documented_options(documentation):
+    """returns {option: (choices, aliases)} of a DOCUMENTATION string"""
+    doc = yaml.safe_load(documentation)
+    if not isinstance(doc, dict) or not isinstance(doc.get('options'), dict):
+        raise ValueError('DOCUMENTATION has no options mapping')
+    options = {}
+    for key, value in doc['options'].items():
+        value = value or {}
+        options[key] = ([str(x) for x in value.get('choices') or []], [str(x) for x in value.get('aliases') or []])
+    return options
+
+
+def check_source(name, source):
+    """
+    Parameters
+    ----------
+    name : str
+        file name of the module, e.g. auto_fvBD.py
+    source : str
+        text of the module
+    Returns
+    -------
+    list
+        problems found, empty if the module is valid
+    """
+    try:
+        tree = compile(source, name, 'exec', ast.PyCF_ONLY_AST)
+        compile(tree, name, 'exec')
+    except SyntaxError as e:
+        return ['does not compile: {}'.format(e)]
+    assignments = _assignments(tree)
+    if 'DOCUMENTATION' not in assignments:
+        return [] # module_utils, nothing else to check
+
+    problems = []
+    try:
+        documented = documented_options(ast.literal_eval(assignments['DOCUMENTATION']))
+    except (ValueError, yaml.YAMLError) as e:
+        problems.append('invalid DOCUMENTATION: {}'.format(e))
+        documented = None
+    try:
+        if 'TABLE' in assignments:
+            options, required_if = table_spec(ast.literal_eval(assignments['TABLE']))
+        else:
+            options, required_if = source_spec(tree)
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        return problems + ['unreadable argument_spec: {}'.format(e)]
+
+    for entry in required_if or []:
+        if not entry[2]:
+            problems.append('required_if for {} {} requires no option'.format(entry[0], entry[1]))
+    if documented is not None:
+        for key in sorted(set(options) - set(documented)):
+            problems.append('option {} is not documented'.format(key))
+        for key in sorted(set(documented) - set(options)):
+            problems.append('documented option {} is not in argument_spec'.format(key))
+        for key in sorted(set(options) & set(documented)):
+            (choices, aliases), (doc_choices, doc_aliases) = options[key], documented[key]
+            if [str(x) for x in choices] != doc_choices:
+                problems.append('choices of {} are {} but documented as {}'.format(key, choices, doc_choices))
+            if list(aliases) != doc_aliases:
+                problems.append('aliases of {} are {} but documented as {}'.format(key, aliases, doc_aliases))
+    return problems
+
+
+def _check_task(task):
+    """returns (name, problems, seconds) of a (name, source) task"""
+    name, source = task
+    start = time.perf_counter()
+    problems = check_source(name, source)
+    return name, problems, time.perf_counter() - start
+
+
+def validate(sources, jobs=1):
+    """
+    Parameters
+    ----------
+    sources : iterable
+        (file name, text) of the modules
+    jobs : int
+        number of processes checking modules
+    Returns
+    -------
+    list
+        (file name, problems, seconds) of every module, in order
+    """
+    if jobs <= 1:
+        return [_check_task(task) for task in sources]
+    sources = list(sources)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(_check_task, sources, chunksize=max(1, len(sources) // (jobs * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_sources(output, names=None):
+    """
+    returns [(file name, text)] of names (every .py file if None) in output,
+    a directory or an archive written by ArchiveSink
+    """
+    try:
+        mode = archive_mode(output)
+    except ValueError:
+        if names is None:
+            names = sorted(name for name in os.listdir(output) if name.endswith('.py'))
+        sources = []
+        for name in names:
+            with io.open(os.path.join(output, name), 'r', encoding='utf-8') as f:
+                sources.append((name, f.read()))
+        return sources
+    if mode is None:
+        with zipfile.ZipFile(output) as archive:
+            names = [name for name in archive.namelist() if name.endswith('.py')] if names is None else names
+            return [(name, archive.read(name).decode('utf-8')) for name in names]
+    with tarfile.open(output) as archive:
+        names = [name for name in archive.getnames() if name.endswith('.py')] if names is None else names
+        return [(name, archive.extractfile(name).read().decode('utf-8')) for name in names]
+
+
+def report(results, verbose=False, out=sys.stdout):
+    """prints the problems of results (all of them with their timing if verbose); returns the number of invalid modules"""
+    invalid = 0
+    for name, problems, seconds in results:
+        if problems:
+            invalid += 1
+        if problems or verbose:
+            print("{:.3f}s {} {}".format(seconds, name, 'invalid' if problems else 'ok'), file=out)
+        for problem in problems:
+            print("    {}".format(problem), file=out)
+    return invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate generated Ansible modules')
+    parser.add_argument('output', nargs='?', default=os.curdir, help='directory or archive of the modules')
+    parser.add_argument('-j', '--jobs', type=int, default=multiprocessing.cpu_count(), help='number of processes')
+    parser.add_argument('-v', '--verbose', action='store_true', help='list every module with its timing')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = validate(read_sources(args.output), args.jobs)
+    invalid = report(results, args.verbose)
+    print("{} modules valid, {} invalid in {:.2f}s".format(len(results) - invalid, invalid,
+                                                         time.perf_counter() - start))
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()